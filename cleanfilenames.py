@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os, sys, shutil, unicodedata
+from treewalk import Baumlauf
 
 
 ersetzungen = {
@@ -27,15 +28,14 @@ def cleanfilename(filename):
 
 top = sys.argv[1]
 
-for root, dirs, files in os.walk(top):
-	for f in files:
-		clean = cleanfilename(f)
-		print root, "\t", f, "\t", clean
-		shutil.move(os.path.join(root, f), os.path.join(root, clean))
-	if len(sys.argv) > 2:
-		for x in range(len(dirs)):
-			d = dirs[x]
-			clean = cleanfilename(d)
-			dirs[x] = clean
-			print root, "\t", d, "\t", clean
-			shutil.move(os.path.join(root, d), os.path.join(root, clean))
+# erst alles einsammeln, dann von unten nach oben umbenennen,
+# damit die Pfade der noch ausstehenden Einträge gültig bleiben
+eintraege = []
+for root, stapel in Baumlauf(top, versteckte=True, verzeichnisse=len(sys.argv) > 2):
+	eintraege.extend([(root, e.name) for e in stapel])
+eintraege.sort(key=lambda eintrag: -eintrag[0].count(os.sep))
+
+for root, f in eintraege:
+	clean = cleanfilename(f)
+	print root, "\t", f, "\t", clean
+	shutil.move(os.path.join(root, f), os.path.join(root, clean))
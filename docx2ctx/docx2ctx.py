@@ -606,6 +606,8 @@ def process_doc(docx, options):
         return False
     if os.path.isdir(docx):
         logging.info('%s is a directory', docx)
+        # not recursive, so a single scandir is all the walking needed;
+        # is_file() follows symlinks and skips links to directories
         for entry in os.scandir(docx):
             if not entry.name.startswith('.') and entry.is_file():
                 options.outputfile = ''
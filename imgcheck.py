@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from __future__ import print_function
 import sys, os, unicodedata
 import PIL.Image as Image
+from treewalk import Baumlauf
 
 imgexts = ('.jpg', '.tif', '.pdf', '.bmp', '.pct', '.tga', '.jpeg', '.tiff', '.pict')
 txtexts = ('.doc', '.rtf', '.txt', '.xml', '.html', '.htm', '.indd', '.pdf')
@@ -56,22 +57,17 @@ if not os.path.isdir(path):
     sys.exit(1)
 
 out = ''
-for root, dirs, files in os.walk(path):
-    try:
-        root = compose(root)
-        pfadname = "\n[%s]\n" % root.strip('.').strip('/')
-    except UnicodeDecodeError as ex:
-        print(ex)
-        print(root)
-        sys.exit()
-    bilder = 0
+letztes = None
+for root, eintraege in Baumlauf(path, bei_fehler=print):
+    root = compose(root)
     subout = ''
-    for filename in files:
-        if filename.startswith('.'): continue
-        (basename, ext) = os.path.splitext(filename)
+    for eintrag in eintraege:
+        (basename, ext) = os.path.splitext(eintrag.name)
         if not ext in txtexts:
-            bilder += 1
-            subout += checkimage(filename, root)
-    if bilder > 0:
-        out += pfadname + subout
+            subout += checkimage(eintrag.name, root)
+    if subout:
+        if root != letztes: # große Verzeichnisse kommen in mehreren Stapeln
+            out += "\n[%s]\n" % root.strip('.').strip('/')
+            letztes = root
+        out += subout
 print(out)
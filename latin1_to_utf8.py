@@ -9,6 +9,9 @@ quellcodierung_to_zielcodierung.py [Optionen] Quelldatei [Zieldatei]
 
 Es können auch ganze Verzeichnisse bearbeitet werden.
 
+Dateien, die sich nicht ändern würden (reines ASCII oder, bei Ziel utf8,
+schon gültiges UTF-8), werden nicht angefasst, nur ggf. ins Ziel kopiert.
+
 Die gewünschte Codierung wird aus dem Dateinamen ermittelt.
 Mögliche Werte sind z.B.
 latin1 (iso-8859-1), utf8, macroman, latex (sofern latex.py vorhanden ist)
@@ -17,42 +20,730 @@ Optionen:
 --filter=Dateiendung
 --overwrite          (sonst wird die Originaldatei gesichert)
 --hidden             (sonst werden versteckte Dateien ignoriert)
+--buffer=Bytes       Größe der Stücke, in denen gelesen wird (1048576)
+--jobs=N             Dateien eines Verzeichnisses mit N Prozessen konvertieren
+--mmap=Bytes         Dateien ab dieser Größe per mmap konvertieren, dabei
+                     ASCII-Abschnitte direkt kopieren (67108864, 0 = nie)
+--scan=Bericht       nichts konvertieren, nur alle Dateien lesen und einordnen;
+                     Bericht als CSV oder, bei Endung .json, als JSON
+                     (ascii, target = schon Zielcodierung, source = gültige
+                     Quellcodierung, undecodable mit Byte-, unencodable
+                     mit Zeichen-Stelle, siehe offset_unit),
+                     mit Summen und geschätzter Laufzeit der Konvertierung;
+                     read_seconds ist nur die Zeit zum Lesen und Dekodieren,
+                     die Schätzung beruht auf einer Probekonvertierung
+                     einiger Dateien in ein temporäres Verzeichnis
+
+Bei Verzeichnissen wird im Ziel ein Manifest .umcodiert.jsonl geführt
+(Quelle, Größe, mtime, Codierungen, MD5 der Ausgabe); ein abgebrochener
+oder wiederholter Lauf überspringt Dateien, deren Ziel (und ggf. Quelle)
+sich seitdem nicht geändert hat, und die dabei angelegten Sicherungen.
 """
 
-import os, sys, codecs, getopt, shutil
+import os, sys, re, csv, json, mmap, time, errno, codecs, getopt, shutil, hashlib, tempfile, fnmatch
+sys.path.append(os.path.dirname(__file__))
+try:
+    from treewalk import Baumlauf
+except ImportError:
+    # das Skript allein kopiert: dasselbe, soweit dateiliste es braucht, mit os.walk
+    class _Eintrag(object):
+        def __init__(self, verzeichnis, name):
+            self.name = name
+            self.path = os.path.join(verzeichnis, name)
+
+        def is_dir(self):
+            return os.path.isdir(self.path)
+
+    class Baumlauf(object):
+        def __init__(self, wurzel, einschliessen=None, versteckte=False, verzeichnisse=False, links=False):
+            self.wurzel = wurzel
+            self.einschliessen = einschliessen
+            self.versteckte = versteckte
+            self.verzeichnisse = verzeichnisse
+            self.links = links
+            self.ignoriert = 0
+
+        def __iter__(self):
+            for pfad, verzeichnisse, dateien in os.walk(self.wurzel, followlinks=self.links):
+                if not self.versteckte:
+                    sichtbar = [name for name in verzeichnisse if not name.startswith('.')]
+                    self.ignoriert += len(verzeichnisse) - len(sichtbar)
+                    verzeichnisse[:] = sichtbar
+                    sichtbar = [name for name in dateien if not name.startswith('.')]
+                    self.ignoriert += len(dateien) - len(sichtbar)
+                    dateien = sichtbar
+                if self.einschliessen:
+                    dateien = [name for name in dateien if fnmatch.fnmatchcase(name, self.einschliessen)]
+                if not self.verzeichnisse:
+                    verzeichnisse = []
+                eintraege = [_Eintrag(pfad, name) for name in verzeichnisse + dateien]
+                if eintraege:
+                    yield pfad, eintraege
 try:
-    sys.path.append(os.path.dirname(__file__))
     import latex
     latex.register()
 except:
     pass
     #print u"Couldn't find LaTeX encoding!"
 
-modes = ('filter', 'overwrite', 'hidden')
+modes = ('filter', 'overwrite', 'hidden', 'buffer', 'jobs', 'scan', 'mmap')
 mode = {}
+puffer = 2**20
+jobs = 1
+stichprobe = 2**16
+mmap_ab = 2**26
+manifest_name = '.umcodiert.jsonl'
 
 def help(message=""):
     print message
     print __doc__
     sys.exit(1)
 
-def backup(datei):
-    original = datei
-    pfad, datei = os.path.split(datei)
+def sicherungsname(datei, namen):
+    """Erster freier Name datei.N.ext, der nicht in namen (den Namen im
+    Verzeichnis) vorkommt; er wird in namen eingetragen"""
     datei, ext = os.path.splitext(datei)
     count = 0
-    while os.path.exists(os.path.join(pfad, u"%s.%d%s" % (datei, count, ext))):
+    while "%s.%d%s" % (datei, count, ext) in namen:
         count += 1
-    neudatei = os.path.join(pfad, u"%s.%d%s" % (datei, count, ext))
-    print u"Sichere %s als %s" % (original, neudatei)
-    shutil.copy(original, neudatei)
+    neuname = "%s.%d%s" % (datei, count, ext)
+    namen.add(neuname)
+    return neuname
+
+def backup(datei, melden=True, neudatei=None):
+    """Sichert datei als datei.N.ext (ohne neudatei mit dem kleinsten
+    freien N) per Hardlink oder, wo das nicht geht, durch Umbenennen;
+    datei muss danach also neu geschrieben werden"""
+    original = datei
+    pfad, datei = os.path.split(datei)
+    if not neudatei:
+        neudatei = os.path.join(pfad, sicherungsname(datei, set(os.listdir(pfad or os.curdir))))
+    if melden:
+        print u"Sichere %s als %s" % (original, neudatei)
+    try:
+        os.link(original, neudatei)
+    except AttributeError:
+        os.rename(original, neudatei)   # kein os.link (Windows)
+    except OSError, ex:
+        if ex.errno == errno.EEXIST:
+            return backup(original, melden)     # inzwischen vergeben
+        os.rename(original, neudatei)
     return neudatei
 
+_umask = None
+
+def ersetze(temp, target, overwrite=False, melden=True, sicherungsname=None):
+    """Setzt die fertige Datei temp an die Stelle von target (atomar per
+    rename); ein vorhandenes target wird ohne overwrite vorher gesichert.
+    Liefert den Namen der Sicherung oder None"""
+    global _umask
+    sicherung = None
+    if os.path.exists(target):
+        shutil.copymode(target, temp)
+        if not overwrite:
+            sicherung = backup(target, melden, sicherungsname)
+    else:
+        if _umask is None:
+            _umask = os.umask(0)
+            os.umask(_umask)
+        os.chmod(temp, 0666 & ~_umask)  # wie eine neu angelegte Datei
+    os.rename(temp, target)
+    return sicherung
+
 def is_hidden(datei):
     if os.path.dirname(datei) in ('.', '..'):
-        return false
+        return False
     return (os.path.basename(datei).startswith('.') or os.sep+'.' in datei)
 
+def kopiere(so_file, ta_file, so_enc, ta_enc, groesse=puffer):
+    """Liest so_file in Stücken von groesse Bytes (oder zeilenweise, siehe
+    zeilenweise()) und schreibt sie umcodiert nach ta_file; liefert die
+    Zahl der gelesenen Bytes"""
+    decoder = codecs.getincrementaldecoder(so_enc)()
+    encoder = codecs.getincrementalencoder(ta_enc)()
+    anzahl = 0
+    if zeilenweise(so_enc):
+        for zeile in so_file:
+            anzahl += len(zeile)
+            ta_file.write(encoder.encode(unicode(zeile, so_enc)))
+        ta_file.write(encoder.encode(u'', True))
+        return anzahl
+    while True:
+        stueck = so_file.read(groesse)
+        anzahl += len(stueck)
+        ta_file.write(encoder.encode(decoder.decode(stueck, not stueck), not stueck))
+        if not stueck:
+            return anzahl
+
+_nicht_ascii = re.compile('[\x80-\xff]')
+_ascii_gleich = {}
+
+def ascii_gleich(so_enc, ta_enc):
+    "Lässt die Konvertierung ASCII-Text unverändert?"
+    if (so_enc, ta_enc) not in _ascii_gleich:
+        ascii = ''.join(map(chr, range(128)))
+        gleich = True
+        try:
+            for text in [ascii] + list(ascii):
+                if unicode(text, so_enc) != unicode(text, 'ascii') or unicode(text, 'ascii').encode(ta_enc) != text:
+                    gleich = False
+        except:
+            gleich = False
+        _ascii_gleich[(so_enc, ta_enc)] = gleich
+    return _ascii_gleich[(so_enc, ta_enc)]
+
+# macht aus allen Bytes ab 0x80 ein \x80, damit find sie schnell findet
+_markiere = ''.join(map(chr, range(128))) + '\x80' * 128
+_ascii_getrennt = {}
+
+def ascii_getrennt(so_enc, ta_enc):
+    """Kann man Text an ASCII-Zeichen teilen und die Teile einzeln umcodieren?
+    Dazu muss ASCII unverändert bleiben und kein Byte ab 0x80 in der
+    Quellcodierung mit einem folgenden ASCII-Byte zusammengehören"""
+    if (so_enc, ta_enc) not in _ascii_getrennt:
+        getrennt = ascii_gleich(so_enc, ta_enc)
+        try:
+            for b in range(0x80, 0x100):
+                if not unicode(chr(b) + 'A', so_enc, 'replace').endswith(u'A'):
+                    getrennt = False
+        except:
+            getrennt = False
+        _ascii_getrennt[(so_enc, ta_enc)] = getrennt
+    return _ascii_getrennt[(so_enc, ta_enc)]
+
+_zeilenweise = {}
+
+def zeilenweise(so_enc):
+    """Muss die Quelle Zeile für Zeile dekodiert werden, wie es das Skript
+    schon immer getan hat? Am Stück gibt es nur dann dasselbe, wenn ASCII
+    für sich allein steht (Latin-1, UTF-8 ...); bei latex etwa reicht der
+    Leerraum nach einem Befehl sonst über das Zeilenende hinaus.
+    Codierungen, in denen ein Zeilenende kein einzelnes Byte ist (UTF-16),
+    werden dagegen am Stück gelesen"""
+    if so_enc not in _zeilenweise:
+        try:
+            zeilen = unicode('\n', so_enc) == u'\n'
+        except:
+            zeilen = False
+        _zeilenweise[so_enc] = zeilen and not ascii_getrennt(so_enc, 'utf-8')
+    return _zeilenweise[so_enc]
+
+def kopiere_mmap(so_file, ta_file, so_enc, ta_enc, groesse=puffer):
+    """Wie kopiere, aber über mmap: ASCII-Abschnitte werden unverändert
+    geschrieben, umcodiert werden nur die Bytes ab 0x80 (samt ASCII-Lücken
+    bis 256 Bytes), oder ganze Stücke mit mehr als einem davon je KB.
+    Geht nur, wenn ascii_getrennt(so_enc, ta_enc) und die
+    Datei nicht leer ist und kein \\r enthält; liefert sonst None, ohne
+    zu schreiben, und ansonsten die Zahl der gelesenen Bytes"""
+    if not ascii_getrennt(so_enc, ta_enc):
+        return None
+    laenge = os.fstat(so_file.fileno()).st_size
+    if not laenge:
+        return None
+    karte = mmap.mmap(so_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for start in xrange(0, laenge, groesse):
+            if '\r' in karte[start:start+groesse]:
+                return None
+        start = 0
+        while start < laenge:
+            ende = min(start + groesse, laenge)
+            while ende < laenge and karte[ende-1] >= '\x80':
+                ende += 1       # Stücke enden hinter einem ASCII-Byte
+            block = karte[start:ende].translate(_markiere)
+            pos = 0
+            hoch = block.find('\x80')
+            if block.count('\x80') > len(block) >> 10:
+                hoch = -1       # zu viele, das ganze Stück umcodieren ist schneller
+                ta_file.write(unicode(karte[start:ende], so_enc).encode(ta_enc))
+                pos = ende - start
+            while hoch >= 0:
+                bis = hoch + 1
+                naechstes = block.find('\x80', bis, bis + 257)
+                while naechstes >= 0:
+                    bis = naechstes + 1
+                    naechstes = block.find('\x80', bis, bis + 257)
+                ta_file.write(buffer(karte, start + pos, hoch - pos))
+                ta_file.write(unicode(karte[start+hoch:start+bis], so_enc).encode(ta_enc))
+                pos = bis
+                hoch = block.find('\x80', bis)
+            ta_file.write(buffer(karte, start + pos, ende - start - pos))
+            start = ende
+    finally:
+        karte.close()
+    return laenge
+
+class Pruefsumme(object):
+    "Hülle um eine Ausgabedatei, die beim Schreiben die MD5-Summe mitrechnet"
+    def __init__(self, datei):
+        self.datei = datei
+        self.md5 = hashlib.md5()
+
+    def write(self, daten):
+        self.md5.update(daten)
+        self.datei.write(daten)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+def unnoetig(source, so_enc, ta_enc, groesse=puffer, md5=None):
+    """Prüft, ob die Konvertierung source nicht ändern würde: reines ASCII
+    oder, bei Ziel UTF-8, schon gültiges UTF-8, jeweils ohne \\r (das "rU"
+    umwandeln würde). Erst wird eine Stichprobe vom Anfang geprüft, dann
+    der Rest. Liefert 'ASCII', 'UTF-8' oder None; ist das Ergebnis nicht
+    None, enthält md5 (falls angegeben) die Summe der ganzen Datei"""
+    if not ascii_gleich(so_enc, ta_enc):
+        return None
+    utf8 = codecs.lookup(ta_enc).name == 'utf-8'
+    decoder = None
+    so_file = file(source, "rb")
+    try:
+        try:
+            stueck = so_file.read(stichprobe)
+            while stueck:
+                if '\r' in stueck:
+                    return None
+                if decoder is None and _nicht_ascii.search(stueck):
+                    if not utf8:
+                        return None
+                    decoder = codecs.getincrementaldecoder('utf-8')()
+                if decoder:
+                    decoder.decode(stueck)
+                if md5:
+                    md5.update(stueck)
+                stueck = so_file.read(groesse)
+            if decoder:
+                decoder.decode('', True)
+        except UnicodeDecodeError:
+            return None
+    finally:
+        so_file.close()
+    return decoder and 'UTF-8' or 'ASCII'
+
+def konvertiere_datei(source, target, so_enc, ta_enc, groesse=puffer, overwrite=False, melden=True,
+        sicherungsname=None):
+    """Konvertiert die Datei source nach target; ohne overwrite wird
+    ein vorhandenes target (auch das Original) vorher gesichert.
+    Geschrieben wird in eine temporäre Datei neben target, die dann
+    an seine Stelle tritt. Würde sich nichts ändern, wird source nur
+    ggf. nach target kopiert.
+    Liefert (gelesene Bytes, Sekunden, Sicherungsdatei oder None,
+    None oder 'ASCII'/'UTF-8', wenn nichts zu tun war, MD5 von target)"""
+    start = time.time()
+    md5 = hashlib.md5()
+    grund = unnoetig(source, so_enc, ta_enc, groesse, md5)
+    if grund and source==target:
+        return os.path.getsize(source), time.time() - start, None, grund, md5.hexdigest()
+    if melden and not grund:
+        print u"Konvertiere %s (%s)\n\tnach %s (%s)" % (source, so_enc, target, ta_enc)
+    pfad, name = os.path.split(target)
+    fd, temp = tempfile.mkstemp(suffix='.tmp', prefix='.%s.' % name, dir=pfad or os.curdir)
+    try:
+        ta_file = os.fdopen(fd, "w")
+        ausgabe = Pruefsumme(ta_file)
+        try:
+            anzahl = None
+            if not grund and mmap_ab and os.path.getsize(source) >= mmap_ab:
+                so_file = file(source, "rb")
+                try:
+                    anzahl = kopiere_mmap(so_file, ausgabe, so_enc, ta_enc, groesse)
+                finally:
+                    so_file.close()
+            if anzahl is None:
+                so_file = file(source, grund and "rb" or "rU")
+                try:
+                    if grund:
+                        shutil.copyfileobj(so_file, ausgabe, groesse)
+                        anzahl = so_file.tell()
+                    else:
+                        anzahl = kopiere(so_file, ausgabe, so_enc, ta_enc, groesse)
+                finally:
+                    so_file.close()
+        finally:
+            ta_file.close()
+        sicherung = ersetze(temp, target, overwrite, melden, sicherungsname)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return anzahl, time.time() - start, sicherung, grund, ausgabe.hexdigest()
+
+def _konvertiere(args):
+    """Hilfsfunktion für den Prozess-Pool: eine Datei konvertieren, Fehler
+    melden statt abbrechen; liefert auch den Eintrag fürs Manifest"""
+    source, target, so_enc, ta_enc, groesse, overwrite, sicherung = args
+    try:
+        vorher = os.stat(source)
+        anzahl, dauer, sicherung, grund, md5 = konvertiere_datei(source, target, so_enc, ta_enc,
+            groesse, overwrite, False, sicherung)
+        nachher = os.stat(target)
+    except (IOError, OSError, UnicodeError), ex:
+        return source, 0, 0.0, None, None, str(ex), None
+    eintrag = {'source': source, 'size': vorher.st_size, 'mtime': vorher.st_mtime,
+        'from': so_enc, 'to': ta_enc, 'md5': md5, 'target': target,
+        'target_size': nachher.st_size, 'target_mtime': nachher.st_mtime, 'backup': sicherung}
+    return source, anzahl, dauer, sicherung, grund, None, eintrag
+
+def _text(pfad):
+    "Pfad als Unicode fürs Manifest (Bytes, die nicht passen, als Latin-1)"
+    if isinstance(pfad, unicode):
+        return pfad
+    try:
+        return pfad.decode(sys.getfilesystemencoding() or 'utf-8')
+    except UnicodeError:
+        return pfad.decode('latin-1')
+
+def lies_manifest(dateiname, so_enc, ta_enc):
+    """Einträge des Manifests für diese Codierungen nach Quelle (relativ
+    zum Quellverzeichnis; spätere Zeilen gelten) und die Menge der dabei
+    angelegten Sicherungen (relativ zum Zielverzeichnis)"""
+    erledigt, sicherungen = {}, set()
+    if not os.path.exists(dateiname):
+        return erledigt, sicherungen
+    manifest = open(dateiname, "rb")
+    try:
+        for zeile in manifest:
+            try:
+                eintrag = json.loads(zeile)
+            except ValueError:
+                continue        # beim Abbruch nur halb geschriebene Zeile
+            if eintrag.get('backup'):
+                sicherungen.add(eintrag['backup'])
+            if eintrag.get('from') == so_enc and eintrag.get('to') == ta_enc:
+                erledigt[eintrag['source']] = eintrag
+    finally:
+        manifest.close()
+    return erledigt, sicherungen
+
+def schon_erledigt(eintrag, source, target):
+    """Ist source laut Manifest-Eintrag schon nach target konvertiert?
+    target muss noch Größe und mtime von damals haben, eine eigene
+    Quelle ebenso"""
+    if not eintrag:
+        return False
+    try:
+        ziel = os.stat(target)
+        if (ziel.st_size, ziel.st_mtime) != (eintrag['target_size'], eintrag['target_mtime']):
+            return False
+        if source != target:
+            quelle = os.stat(source)
+            return (quelle.st_size, quelle.st_mtime) == (eintrag['size'], eintrag['mtime'])
+    except OSError:
+        return False
+    return True
+
+def dateiliste(source, target=None):
+    """Liste der Tripel (Quelle, Ziel, Sicherung) aller zu konvertierenden
+    Dateien unter source und die Zahl der ignorierten versteckten Einträge.
+    Sicherung ist der Name für die Sicherung eines vorhandenen Ziels
+    (ohne overwrite), gefunden mit einem listdir je Zielverzeichnis;
+    fehlende Zielverzeichnisse werden angelegt.
+    Ohne target sind Ziel und Sicherung None, und es wird nichts angelegt"""
+    liste = []
+    ziele = {source: target}
+    neu = set()
+    if target is not None and not os.path.isdir(target):
+        os.makedirs(target)
+        neu.add(target)
+    gelesen, namen = None, set()
+    lauf = Baumlauf(source, einschliessen=mode['filter'] and '*' + mode['filter'],
+        versteckte=mode['hidden'], verzeichnisse=target is not None, links=True)
+    for quelle, eintraege in lauf:
+        ziel = ziele.get(quelle)
+        for eintrag in eintraege:
+            if ziel is not None and eintrag.is_dir():
+                unterziel = ziele[eintrag.path] = os.path.join(ziel, eintrag.name)
+                if not os.path.isdir(unterziel):
+                    os.makedirs(unterziel)
+                    neu.add(unterziel)
+                continue
+            sicherung = None
+            if ziel is not None and ziel not in neu and not mode['overwrite']:
+                if gelesen != ziel:     # die Stapel eines Verzeichnisses kommen nacheinander
+                    gelesen, namen = ziel, set(os.listdir(ziel))
+                if eintrag.name in namen:
+                    sicherung = os.path.join(ziel, sicherungsname(eintrag.name, namen))
+            liste.append((eintrag.path, ziel and os.path.join(ziel, eintrag.name), sicherung))
+    liste.sort()
+    return liste, lauf.ignoriert
+
+def verzeichnis(source, target, so_enc, ta_enc):
+    """Konvertiert alle Dateien unter source mit jobs Prozessen;
+    meldet jede Datei in einer Zeile und am Ende die Summen.
+    Was laut Manifest schon erledigt ist, wird übersprungen"""
+    start = time.time()
+    liste, ignoriert = dateiliste(source, target)
+    manifest = os.path.join(target, manifest_name)
+    erledigt, sicherungen = lies_manifest(manifest, so_enc, ta_enc)
+    auftraege = []
+    uebersprungen = 0
+    for s, t, b in liste:
+        if s == manifest:
+            continue
+        name = _text(os.path.relpath(s, source))
+        if (source == target and name in sicherungen) or schon_erledigt(erledigt.get(name), s, t):
+            uebersprungen += 1
+            continue
+        auftraege.append((s, t, so_enc, ta_enc, puffer, mode['overwrite'], b))
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        ergebnisse = pool.imap(_konvertiere, auftraege, 16)
+    else:
+        ergebnisse = (_konvertiere(auftrag) for auftrag in auftraege)
+    summe = fehler = fertig = 0
+    protokoll = open(manifest, "ab")
+    try:
+        for datei, anzahl, dauer, sicherung, grund, fehlermeldung, eintrag in ergebnisse:
+            if fehlermeldung:
+                print "%s: Fehler: %s" % (datei, fehlermeldung)
+                fehler += 1
+                continue
+            eintrag['source'] = _text(os.path.relpath(eintrag['source'], source))
+            eintrag['target'] = _text(os.path.relpath(eintrag['target'], target))
+            if eintrag['backup']:
+                eintrag['backup'] = _text(os.path.relpath(eintrag['backup'], target))
+            protokoll.write(json.dumps(eintrag, sort_keys=True) + "\n")
+            protokoll.flush()
+            if grund:
+                print "%s: schon %s, nicht konvertiert" % (datei, grund)
+                fertig += 1
+                continue
+            summe += anzahl
+            if sicherung:
+                print "%s: %d Bytes in %.2f s, gesichert als %s" % (datei, anzahl, dauer, sicherung)
+            else:
+                print "%s: %d Bytes in %.2f s" % (datei, anzahl, dauer)
+        if pool:
+            pool.close()
+    finally:
+        protokoll.close()
+        if pool:
+            pool.terminate()
+            pool.join()
+    dauer = time.time() - start
+    print "%d Dateien konvertiert, %d Bytes in %.2f s (%.0f Bytes/s), %d schon fertig, %d laut Manifest erledigt, %d Fehler, %d versteckte ignoriert" % (
+        len(auftraege) - fertig - fehler, summe, dauer, summe / max(dauer, 1e-6), fertig, uebersprungen,
+        fehler, ignoriert)
+
+def bytecodierung(so_enc):
+    """Codierung der Bytes unter einer Textcodierung wie latex (ASCII) oder
+    latex+latin1 (Latin-1); None, wenn so_enc selbst Bytes dekodiert. Der
+    latex-Decoder hält Text statt Bytes zurück und meldet Fehler relativ
+    zum Befehl, daraus ergibt sich keine Byte-Position"""
+    name = codecs.lookup(so_enc).name
+    if name == 'latex':
+        return 'ascii'
+    if name.startswith('latex+'):
+        return name[6:]
+    return None
+
+def untersuche(source, so_enc, ta_enc, groesse=puffer):
+    """Liest source einmal, ohne etwas zu schreiben, und ordnet die Datei
+    ein: 'ascii', 'target' (schon gültiges UTF-8 bei Ziel UTF-8), 'source'
+    (gültig in der Quellcodierung und in die Zielcodierung umzuwandeln),
+    'undecodable' (offset in Bytes) oder 'unencodable' (offset in Zeichen,
+    siehe offset_unit). Liefert ein dict für den Bericht"""
+    start = time.time()
+    decoder = codecs.getincrementaldecoder(so_enc)()
+    bytes_decoder = None
+    if bytecodierung(so_enc):
+        bytes_decoder = codecs.getincrementaldecoder(bytecodierung(so_enc))()
+    encoder = codecs.getincrementalencoder(ta_enc)()
+    pruefer = None
+    if codecs.lookup(ta_enc).name == 'utf-8' and codecs.lookup(so_enc).name != 'utf-8':
+        pruefer = codecs.getincrementaldecoder('utf-8')()
+    ascii, cr = True, False
+    klasse = offset = None
+    anzahl = zeichen = 0
+    ganz = True
+    so_file = file(source, "rb")
+    try:
+        while True:
+            stueck = so_file.read(groesse)
+            ende = not stueck
+            if ascii and _nicht_ascii.search(stueck):
+                ascii = False
+            cr = cr or '\r' in stueck
+            if pruefer:
+                try:
+                    pruefer.decode(stueck, ende)
+                except UnicodeDecodeError:
+                    pruefer = None
+            if klasse is None and bytes_decoder:
+                try:
+                    rest = len(bytes_decoder.getstate()[0])
+                    bytes_decoder.decode(stueck, ende)
+                except UnicodeDecodeError, ex:
+                    klasse, offset = 'undecodable', anzahl - rest + ex.start
+            if klasse is None:
+                try:
+                    rest = len(decoder.getstate()[0])
+                    text = decoder.decode(stueck, ende)
+                except UnicodeDecodeError, ex:
+                    klasse, offset = 'undecodable', anzahl - rest + ex.start
+                else:
+                    try:
+                        encoder.encode(text, ende)
+                    except UnicodeEncodeError, ex:
+                        klasse, offset = 'unencodable', zeichen + ex.start
+                    zeichen += len(text)
+            anzahl += len(stueck)
+            if ende:
+                break
+            if klasse and not ascii and not pruefer:
+                # nichts mehr herauszufinden außer der Größe
+                anzahl = os.fstat(so_file.fileno()).st_size
+                ganz = False
+                break
+    finally:
+        so_file.close()
+    if ascii:
+        klasse = 'ascii'
+    elif pruefer:
+        klasse = 'target'
+    elif klasse is None:
+        klasse = 'source'
+    if klasse not in ('undecodable', 'unencodable'):
+        offset = None
+    sekunden = None
+    if ganz:
+        sekunden = round(time.time() - start, 6)
+    unnoetig = klasse in ('ascii', 'target') and not cr and ascii_gleich(so_enc, ta_enc)
+    return {
+        'file': source,
+        'bytes': anzahl,
+        'class': klasse,
+        'offset': offset,
+        'offset_unit': offset is not None and (klasse == 'unencodable' and 'char' or 'byte') or None,
+        'convert': offset is None and not unnoetig,
+        'read_seconds': sekunden,
+    }
+
+def _untersuche(args):
+    "Hilfsfunktion für den Prozess-Pool: eine Datei untersuchen, Fehler melden statt abbrechen"
+    source, so_enc, ta_enc, groesse = args
+    try:
+        return untersuche(source, so_enc, ta_enc, groesse)
+    except (IOError, OSError), ex:
+        return {'file': source, 'bytes': 0, 'class': 'error', 'offset': None, 'offset_unit': None,
+            'convert': False, 'read_seconds': None, 'error': str(ex)}
+
+def probelauf(dateien, so_enc, ta_enc, grenze=16*puffer, hoechstens=100):
+    """Konvertiert die ersten der zu konvertierenden Dateien (bis grenze
+    Bytes oder hoechstens Dateien) in ein temporäres Verzeichnis (unter
+    tempfile.gettempdir(), in den untersuchten Baum wird nichts geschrieben),
+    misst also Lesen, Umcodieren und Schreiben wie beim echten Lauf (ohne
+    Sicherungen, die nur Hardlinks sind); liefert (Dateien, Bytes,
+    Sekunden) der gelungenen, (0, 0, 0.0) ohne zu konvertierende Dateien"""
+    probe = []
+    summe = 0
+    for datei in dateien:
+        if datei['convert'] and summe < grenze and len(probe) < hoechstens:
+            probe.append(datei['file'])
+            summe += datei['bytes']
+    if not probe:
+        return 0, 0, 0.0
+    temp = tempfile.mkdtemp(prefix='umcodiert-probe.')
+    try:
+        gelungen, anzahl, sekunden = 0, 0, 0.0
+        for nummer, source in enumerate(probe):
+            try:
+                gelesen, dauer = konvertiere_datei(source, os.path.join(temp, str(nummer)), so_enc, ta_enc,
+                    puffer, True, False)[:2]
+            except (IOError, OSError, UnicodeError):
+                continue                # zählt dann nicht zur Probe
+            gelungen += 1
+            anzahl += gelesen
+            sekunden += dauer
+        return gelungen, anzahl, sekunden
+    finally:
+        shutil.rmtree(temp, True)
+
+def scan(source, so_enc, ta_enc, bericht):
+    """Untersucht source (Datei oder Verzeichnis) mit jobs Prozessen und
+    schreibt den Bericht; meldet Problemfälle und die Summen"""
+    start = time.time()
+    if os.path.isdir(source):
+        liste, ignoriert = dateiliste(source)
+    else:
+        liste, ignoriert = [(source, None, None)], 0
+    auftraege = [(s, so_enc, ta_enc, puffer) for s, t, b in liste]
+    pool = None
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        ergebnisse = pool.imap(_untersuche, auftraege, 16)
+    else:
+        ergebnisse = (_untersuche(auftrag) for auftrag in auftraege)
+    dateien = []
+    klassen = {}
+    try:
+        for datei in ergebnisse:
+            dateien.append(datei)
+            summe = klassen.setdefault(datei['class'], {'files': 0, 'bytes': 0})
+            summe['files'] += 1
+            summe['bytes'] += datei['bytes']
+            if datei['class'] == 'error':
+                print "%s: Fehler: %s" % (datei['file'], datei['error'])
+            elif datei['offset'] is not None:
+                print "%s: %s bei %s %d" % (datei['file'], datei['class'],
+                    datei['offset_unit'] == 'char' and 'Zeichen' or 'Byte', datei['offset'])
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    gemessen = [(d['bytes'], d['read_seconds']) for d in dateien if d['read_seconds'] is not None]
+    durchsatz = sum([b for b, s in gemessen]) / max(sum([s for b, s in gemessen]), 1e-6)
+    konvertieren = sum([d['bytes'] for d in dateien if d['convert']])
+    probe_dateien, probe_bytes, probe_sekunden = probelauf(dateien, so_enc, ta_enc)
+    konvertiert = probe_bytes / max(probe_sekunden, 1e-6)
+    summen = {
+        'files': len(dateien),
+        'bytes': sum([d['bytes'] for d in dateien]),
+        'classes': klassen,
+        'convert_files': len([d for d in dateien if d['convert']]),
+        'convert_bytes': konvertieren,
+        'hidden_ignored': ignoriert,
+        'read_bytes_per_second': int(durchsatz),
+        'probe_files': probe_dateien,
+        'probe_bytes': probe_bytes,
+        'convert_bytes_per_second': int(konvertiert),
+        'jobs': jobs,
+        'estimated_seconds': round(konvertieren / max(konvertiert, 1e-6) / jobs, 2),
+        'scan_seconds': round(time.time() - start, 2),
+        'source_encoding': so_enc,
+        'target_encoding': ta_enc,
+    }
+    if bericht.lower().endswith('.json'):
+        json.dump({'files': dateien, 'totals': summen}, open(bericht, 'w'), indent=1, sort_keys=True)
+    else:
+        felder = ['file', 'bytes', 'class', 'offset', 'offset_unit', 'convert', 'read_seconds']
+        ausgabe = open(bericht, 'wb')
+        schreiber = csv.writer(ausgabe)
+        schreiber.writerow(felder)
+        for datei in dateien:
+            schreiber.writerow([datei[feld] for feld in felder])
+        schreiber.writerow([])
+        for schluessel in sorted(summen):
+            if schluessel == 'classes':
+                for klasse in sorted(klassen):
+                    schreiber.writerow(['total', 'class %s' % klasse, klassen[klasse]['files'], klassen[klasse]['bytes']])
+            else:
+                schreiber.writerow(['total', schluessel, summen[schluessel]])
+        ausgabe.close()
+    for klasse in sorted(klassen):
+        print "%-12s %8d Dateien %14d Bytes" % (klasse, klassen[klasse]['files'], klassen[klasse]['bytes'])
+    print "%d Dateien, %d Bytes; zu konvertieren %d Dateien, %d Bytes, geschätzt %.1f s bei %d Jobs" % (
+        summen['files'], summen['bytes'], summen['convert_files'], konvertieren,
+        summen['estimated_seconds'], jobs)
+    print "Lesen und Dekodieren %.0f Bytes/s, Probe mit %d Dateien %.0f Bytes/s (mit Schreiben)" % (
+        durchsatz, probe_dateien, konvertiert)
+    print "Bericht: %s" % bericht
+
 def convert(source, target, so_enc, ta_enc):
     source = os.path.abspath(source)
     target = os.path.abspath(target)
@@ -78,6 +769,10 @@ def convert(source, target, so_enc, ta_enc):
     if not from_exists:
         help(u"Quelle '%s' nicht gefunden!" % from_name)
 
+    if mode['scan']:
+        scan(source, so_enc, ta_enc, mode['scan'])
+        return
+
     if from_isdir:
         if is_hidden(source) and not mode['hidden']:
             print u"Ignoriere verstecktes Verzeichnis %s" % source
@@ -85,37 +780,21 @@ def convert(source, target, so_enc, ta_enc):
         if not to_isdir:
             help(u"Wenn die Quelle ein Verzeichnis ist, muss auch das Ziel ein Verzeichnis sein!")
         print u"Verarbeite Verzeichnis %s" % source
-        dateien = os.listdir(source)
-        #if not mode['hidden']:
-        #    dateien = [d for d in dateien if not is_hidden(d)]
-        if mode['filter']:
-            dateien = [d for d in dateien if d.endswith(mode['filter'])]
-        for datei in dateien:
-            s = os.path.join(source, datei)
-            t = os.path.join(target, datei)
-            convert(s, t, so_enc, ta_enc)
+        verzeichnis(source, target, so_enc, ta_enc)
     else:
         if is_hidden(from_name) and not mode['hidden']:
             print u"Ignoriere versteckte Datei %s" % source
             return
         if to_isdir:
             target = os.path.join(target, from_name)
-        if not mode['overwrite']:
-            if source==target:
-                source=backup(source)
-            elif os.path.exists(target):
-                backup(target)
-        print u"Konvertiere %s (%s)\n\tnach %s (%s)" % (source, so_enc, target, ta_enc)
-        so_file = file(source, "rU")
-        lines = so_file.readlines()
-        so_file.close()
-        ta_file = file(target, "w")
-        for l in lines:
-            ta_file.write(unicode(l, so_enc).encode(ta_enc))
-        ta_file.close()
+        anzahl, dauer, sicherung, grund, md5 = konvertiere_datei(source, target, so_enc, ta_enc, puffer, mode['overwrite'])
+        if grund:
+            print u"%s ist schon %s, nicht konvertiert" % (source, grund)
+        else:
+            print u"\t%d Bytes in %.2f s (%.0f Bytes/s)" % (anzahl, dauer, anzahl / max(dauer, 1e-6))
         
 
-opts, args = getopt.getopt(sys.argv[1:], "ohf:", ["overwrite","hidden","filter="])
+opts, args = getopt.getopt(sys.argv[1:], "ohf:b:j:s:m:", ["overwrite","hidden","filter=","buffer=","jobs=","scan=","mmap="])
 
 if len(args)<1:
     help(u"Zu wenige Parameter angegeben!")
@@ -131,6 +810,30 @@ for m in modes:
                 print u"Modus %s aktiv" % m
             mode[m] = a
 
+if mode['buffer']:
+    try:
+        puffer = int(mode['buffer'])
+    except ValueError:
+        puffer = 0
+    if puffer < 1:
+        help(u"Puffer muss eine positive Zahl sein, nicht '%s'!" % mode['buffer'])
+
+if mode['mmap']:
+    try:
+        mmap_ab = int(mode['mmap'])
+    except ValueError:
+        mmap_ab = -1
+    if mmap_ab < 0:
+        help(u"mmap muss eine Zahl ab 0 sein, nicht '%s'!" % mode['mmap'])
+
+if mode['jobs']:
+    try:
+        jobs = int(mode['jobs'])
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        help(u"jobs muss eine positive Zahl sein, nicht '%s'!" % mode['jobs'])
+
 # gewünschte Codierung aus dem Dateinamen ablesen
 scriptname = os.path.splitext(os.path.basename(__file__))[0]
 from_enc, to_enc = scriptname.split("_to_")
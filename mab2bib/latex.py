@@ -11,9 +11,18 @@ are both available just by letting "import latex" find this file.
  - ustring.decode('latex+latin1')
 where latin1 can be replaced by any other known encoding, also
 become available by calling latex.register().
+ - codecs.open(filename,encoding='latex+latin1')
+ - codecs.getincrementaldecoder('latex')()
+also work on input that arrives in pieces, and
+ - latex.encode_batch(ustrings,'latex+latin1')
+encodes a whole list of strings in one go.
 
 We also make public a dictionary latex_equivalents,
-mapping ord(unicode char) to LaTeX code.
+mapping ord(unicode char) to LaTeX code, and a function equivalents()
+returning it extended by generated entries for accented letters, Greek
+and math symbols.  The generated tables are cached in latex.tables.
+Decoding remembers the conversions of frequent commands like \\"a;
+decode_cache_info() tells how well that works.
 
 D. Eppstein, October 2003.
 source: http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/252124
@@ -23,7 +32,12 @@ modified for mab2bib 2005/2006 by Henning Hraban Ramm
 
 #from __future__ import generators
 import codecs
+import hashlib
+import itertools
+import marshal
+import os
 import re
+import unicodedata
 from sets import Set
 
 def register():
@@ -37,6 +51,37 @@ def getregentry():
     """Encodings module API."""
     return _registry('latex')
 
+def encode_batch(strings,encoding='latex'):
+    """Encode many strings at once, like [s.encode(encoding) for s in strings]
+    where encoding is 'latex' or 'latex+x'.  All strings share one
+    translation table, plain ASCII ones go through unchanged and repeated
+    strings are only encoded once.  Returns a list.
+    """
+    encoding = encoding.lower()
+    if encoding == 'latex':
+        encoding = None
+    elif encoding.startswith('latex+'):
+        encoding = encoding[6:]
+    else:
+        raise LookupError('not a latex encoding: %s' % encoding)
+    table = _encode_table(encoding)
+    special = table.special.search
+    done = {}
+    output = []
+    for s in strings:
+        try:
+            output.append(done[s])
+            continue
+        except KeyError:
+            pass
+        if table.fast and isinstance(s,unicode) and not special(s):
+            e = str(s)      # only ASCII that stands for itself
+        else:
+            e = _encode(s,encoding)
+        done[s] = e
+        output.append(e)
+    return output
+
 def _registry(encoding):
     if encoding == 'latex':
         encoding = None
@@ -48,19 +93,7 @@ def _registry(encoding):
     class Codec(codecs.Codec):
         def encode(self,input,errors='strict'):
             """Convert unicode string to latex."""
-            output = []
-            for c in input:
-                if encoding:
-                    try:
-                        output.append(c.encode(encoding))
-                        continue
-                    except:
-                        pass
-                if ord(c) in latex_equivalents:
-                    output.append(latex_equivalents[ord(c)])
-                else:
-                    output += ['{\\char', str(ord(c)), '}']
-            return ''.join(output), len(input)
+            return _encode(input,encoding), len(input)
 
         def decode(self,input,errors='strict'):
             """Convert latex source string to unicode."""
@@ -75,27 +108,207 @@ def _registry(encoding):
             x = map(unicode,_unlatex(input))
             return u''.join(x), len(input)
 
+    class IncrementalEncoder(codecs.IncrementalEncoder):
+        def encode(self,input,final=False):
+            """Convert unicode string to latex; every character is
+            translated on its own, so there is no state to keep."""
+            return _encode(input,encoding)
+
+    class IncrementalDecoder(codecs.IncrementalDecoder):
+        def __init__(self,errors='strict'):
+            codecs.IncrementalDecoder.__init__(self,errors)
+            self.reset()
+
+        def reset(self):
+            self.buffer = ''            # undecoded tail of the input so far
+            self.lastoutput = 'x'
+            self.fresh = True
+            if encoding:
+                self.bytes = codecs.getincrementaldecoder(encoding)(self.errors)
+
+        def decode(self,input,final=False):
+            """Convert latex source to unicode, keeping back the last few
+            tokens until we know they are not part of a longer sequence."""
+            if encoding:
+                input = self.bytes.decode(input,final)
+            output, self.buffer, self.lastoutput, self.fresh = _decode_part(
+                self.buffer + input, self.lastoutput, final, self.fresh)
+            return output
+
     class StreamWriter(Codec,codecs.StreamWriter):
         pass
 
     class StreamReader(Codec,codecs.StreamReader):
-        pass
+        def __init__(self,stream,errors='strict'):
+            codecs.StreamReader.__init__(self,stream,errors)
+            self.decoder = IncrementalDecoder(errors)
+
+        def read(self,size=-1,chars=-1,firstline=False):
+            """Like codecs.StreamReader.read, but decodes through an
+            IncrementalDecoder, which is flushed at the end of the stream."""
+            if self.linebuffer:
+                self.charbuffer = u''.join(self.linebuffer)
+                self.linebuffer = None
+            while chars < 0 or len(self.charbuffer) < chars:
+                if size < 0:
+                    newdata = self.stream.read()
+                else:
+                    newdata = self.stream.read(size)
+                final = size < 0 or not newdata
+                self.charbuffer += self.decoder.decode(newdata,final)
+                if final:
+                    break
+            if chars < 0:
+                result, self.charbuffer = self.charbuffer, u''
+            else:
+                result, self.charbuffer = self.charbuffer[:chars], self.charbuffer[chars:]
+            return result
+
+        def reset(self):
+            codecs.StreamReader.reset(self)
+            self.decoder.reset()
+
+    return codecs.CodecInfo(
+        name=encoding and 'latex+' + encoding or 'latex',
+        encode=Codec().encode,
+        decode=Codec().decode,
+        incrementalencoder=IncrementalEncoder,
+        incrementaldecoder=IncrementalDecoder,
+        streamreader=StreamReader,
+        streamwriter=StreamWriter,
+    )
 
-    return (Codec().encode,Codec().decode,StreamReader,StreamWriter)
+class _EncodeTable(dict):
+    """Translation table for unicode.translate, one per target encoding.
+
+    Maps ord(c) to c itself if c can be encoded in the target encoding,
+    else to its LaTeX equivalent; entries are computed on first use.
+    Also knows which ASCII characters need no translation at all, so
+    strings consisting only of those can skip translate.
+    """
+
+    def __init__(self,encoding):
+        dict.__init__(self)
+        self.encoding = encoding
+        ascii = u''.join(map(unichr,range(128)))
+        try:
+            # translate + encode only gives the same result as encoding
+            # char by char for stateless, ASCII compatible encodings
+            self.fast = (ascii.encode(encoding or 'ascii') == ascii.encode('ascii')
+                and u'ab'.encode(encoding or 'ascii') == u'a'.encode(encoding or 'ascii') + u'b'.encode(encoding or 'ascii'))
+        except:
+            self.fast = False
+        keep = u''.join([c for c in ascii if self[ord(c)] == c])
+        self.special = re.compile(u'[^%s]' % re.escape(keep))
+
+    def __missing__(self,o):
+        c = unichr(o)
+        if self.encoding:
+            try:
+                c.encode(self.encoding)
+                self[o] = c
+                return c
+            except:
+                pass
+        table = equivalents()
+        if o in table:
+            t = unicode(table[o])
+        else:
+            t = u'{\\char%d}' % o
+        self[o] = t
+        return t
+
+_encode_tables = {}
+
+def _encode_table(encoding):
+    """Cached _EncodeTable for encoding (None for plain latex)."""
+    try:
+        return _encode_tables[encoding]
+    except KeyError:
+        table = _encode_tables[encoding] = _EncodeTable(encoding)
+        return table
+
+def _encode(input,encoding):
+    """Convert unicode string to latex, translating through a cached table."""
+    table = _encode_table(encoding)
+    if not table.fast or not isinstance(input,unicode):
+        return _encode_chars(input,encoding)
+    if table.special.search(input):
+        input = input.translate(table)
+    return input.encode(encoding or 'ascii')
+
+def _encode_chars(input,encoding):
+    """Convert to latex character by character (for byte strings and
+    encodings that _EncodeTable can not handle)."""
+    output = []
+    table = equivalents()
+    for c in input:
+        if encoding:
+            try:
+                output.append(c.encode(encoding))
+                continue
+            except:
+                pass
+        if ord(c) in table:
+            output.append(table[ord(c)])
+        else:
+            output += ['{\\char', str(ord(c)), '}']
+    return ''.join(output)
 
 def _tokenize(tex):
     """Convert latex source into sequence of single-token substrings."""
-    start = 0
-    try:
+    for start,end in _scan_spans(tex):
+        yield tex[start:end]
+
+def _token_spans(tex,fresh=True):
+    """Generate the (start,end) offsets of the tokens of latex source.
+    If not fresh, tex continues earlier input at a token boundary.
+
+    Unlike _tokenize, a run of plain characters becomes one token after
+    its first character; this makes no difference to the conversion."""
+    if isinstance(tex,unicode):
+        for c in Set(_non_latin1.findall(tex)):
+            if not c.isdecimal() and (c.isdigit() or (c.isnumeric() and not c.isalpha())):
+                # _unicode_tokens only knows the odd digits of latin-1
+                return _scan_spans(tex,fresh)
+        return _regexp_spans(tex,fresh,_unicode_tokens)
+    return _regexp_spans(tex,fresh,_tokens)
+
+def _regexp_spans(tex,fresh,tokens):
+    """Token offsets of tex from one of the tokenizer regexps."""
+    pos = 0
+    if fresh:
         # skip quickly across boring stuff
-        pos = _stoppers.finditer(tex).next().span()[0]
-    except StopIteration:
-        yield tex
-        return
+        m = _stoppers.search(tex)
+        if not m:
+            if tex:
+                yield 0,len(tex)
+            return
+        pos = m.start()
+        if pos:
+            yield 0,pos
+    for m in tokens.finditer(tex,pos):
+        if m.lastindex == 5:
+            yield m.span(4)
+            if m.end(5) > m.start(5):
+                yield m.span(5)
+        else:
+            yield m.span(m.lastindex)
+
+def _scan_spans(tex,fresh=True):
+    """Token offsets as from _token_spans, character by character."""
+    start = pos = 0
+    if fresh:
+        try:
+            # skip quickly across boring stuff
+            pos = _stoppers.finditer(tex).next().span()[0]
+        except StopIteration:
+            yield 0,len(tex)
+            return
 
     while 1:
         if pos > start:
-            yield tex[start:pos]
+            yield start,pos
             if tex[start] == '\\' and not (tex[pos-1].isdigit() and tex[start+1].isalpha()):
                 while pos < len(tex) and tex[pos].isspace(): # skip blanks after csname
                     pos += 1
@@ -125,6 +338,44 @@ def _tokenize(tex):
                 while pos < len(tex) and tex[pos].isdigit():
                     pos += 1
 
+def _decode_part(tex,lastoutput,final,fresh):
+    """Convert as much of tex as further input can not change.
+    Returns the converted unicode string, the unconverted rest of tex,
+    the last piece of output and whether the rest is still at the start
+    of the input (see _token_spans).  Helper for IncrementalDecoder."""
+    if not tex:
+        return u'', tex, lastoutput, fresh
+    if fresh and not _stoppers.search(tex):
+        final = True    # all one token, passed through as it is
+    u = _unlatex(tex,lastoutput,final,fresh)
+    output = u''.join(map(unicode,u))
+    start = u.rest()
+    return output, tex[start:], u.lastoutput, fresh and not _stoppers.search(tex[:start])
+
+# Number of tokens _unlatex reads at a time
+_window = 256
+
+# Conversions done by _unlatex.chunk, per type of source (str and
+# unicode tokens must not meet in one dict), and the numbers of hits
+# and misses.  The text between translations makes tokens too, so the
+# number of entries is limited.
+_chunks = {}
+_chunks_limit = 10000
+_chunk_counts = [0,0]
+
+def decode_cache_info():
+    """Return (hits, misses, entries) of the cache of decoded tokens."""
+    return (_chunk_counts[0], _chunk_counts[1],
+        sum([len(chunks) for chunks in _chunks.values()]))
+
+def decode_cache_clear():
+    """Empty the cache of decoded tokens and reset its counters."""
+    _chunks.clear()
+    _chunk_counts[:] = [0,0]
+
+class _Incomplete(Exception):
+    """The conversion needs tokens that are not there yet."""
+
 class _unlatex:
     """Convert tokenized tex into sequence of unicode strings.  Helper for decode()."""
 
@@ -132,69 +383,219 @@ class _unlatex:
         """Turn self into an iterator.  It already is one, nothing to do."""
         return self
 
-    def __init__(self,tex):
-        """Create a new token converter from a string."""
-        self.tex = tuple(_tokenize(tex))  # turn tokens into indexable list
-        self.pos = 0                    # index of first unprocessed token
-        self.lastoutput = 'x'           # lastoutput must always be nonempty string
+    def __init__(self,tex,lastoutput='x',final=True,fresh=True):
+        """Create a new token converter from a string.
+        Unless final, tex may be continued: its last token is not
+        converted, nor anything that depends on the tokens after it."""
+        if _l2u is None:
+            _load_tables()
+        self.source = tex
+        self.chunks = _chunks.setdefault(type(tex),{})
+        self.spans = _token_spans(tex,fresh)
+        self.tex = []                   # window of tokens not yet converted
+        self.starts = []                # their offsets in source
+        self.final = final
+        self.lastoutput = lastoutput    # lastoutput must always be nonempty string
+
+    def fill(self,n):
+        """Read tokens until there are more than n in the window."""
+        t = self.tex
+        while len(t) <= n and self.spans:
+            before = len(t)
+            for start,end in itertools.islice(self.spans,_window):
+                t.append(self.source[start:end])
+                self.starts.append(start)
+            if len(t) - before < _window:
+                self.spans = None       # no more tokens
 
     def __getitem__(self,n):
         """Return token at offset n from current pos."""
-        p = self.pos + n
         t = self.tex
-        return p < len(t) and t[p] or None
+        if len(t) <= n + 1:
+            self.fill(n + 1)
+        if n + 1 < len(t) or (self.final and n < len(t)):
+            return t[n]
+        elif not self.final:
+            raise _Incomplete
+        return None
+
+    def rest(self):
+        """Offset of the first token not converted."""
+        try:
+            self[0]
+        except _Incomplete:
+            pass
+        if self.starts:
+            return self.starts[0]
+        return len(self.source)
 
     def next(self):
         """Find and return another piece of converted output."""
-        if self.pos >= len(self.tex):
-            raise StopIteration
-        nextoutput = self.chunk()
+        t = self.tex
+        n = 0
+        while 1:
+            if n + 1 >= len(t):
+                self.fill(n + 1)
+            if n >= len(t) or t[n][0] not in _blacklist:
+                break
+            if n + 1 == len(t) and not self.final and len(t[n]) == 1:
+                break   # '/' may still become '/~'
+            n += 1      # plain text, no translation starts here
+        if n:
+            nextoutput = t[0][:0].join(t[:n])
+            del t[:n]
+            del self.starts[:n]
+        else:
+            hit = None
+            if len(t) > 2:
+                # the tokens chunk looks at are there, so try _chunks here
+                key = t[0]
+                if t[1] == '{' and (key in _l2u_pairs or key in _accent_marks):
+                    key = None      # argument in braces, see chunk
+                elif key in _l2u_pairs:
+                    key = (key,t[1])
+                if key is not None:
+                    hit = self.chunks.get(key)
+            if hit is not None:
+                _chunk_counts[0] += 1
+                nextoutput, n = hit
+                del t[:n]
+                del self.starts[:n]
+            else:
+                try:
+                    t = self[0]
+                    if t is None:
+                        raise StopIteration
+                    nextoutput = self.chunk(t)
+                except _Incomplete:
+                    raise StopIteration
         if self.lastoutput[0] == '\\' and self.lastoutput[-1].isalpha() and nextoutput[0].isalpha():
             nextoutput = ' ' + nextoutput   # add extra space to terminate csname
         self.lastoutput = nextoutput
         return nextoutput
 
-    def chunk(self):
-        """Grab another set of input tokens and convert them to an output string."""
-        for delta,c in self.candidates(0):
-            if c in _l2u:
-                self.pos += delta
-                return unichr(_l2u[c])
-            elif len(c) == 2 and c[1] == 'i' and (c[0],'\\i') in _l2u:
-                self.pos += delta       # correct failure to undot i
-                return unichr(_l2u[(c[0],'\\i')])
-            elif len(c) == 1 and c[0].startswith('\\char') and c[0][5:].isdigit():
-                self.pos += delta
-                return unichr(int(c[0][5:]))
-
-        # nothing matches, just pass through token as-is
-        self.pos += 1
-        return self[-1]
-
-    def candidates(self,offset):
-        """Generate pairs delta,c where c is a token or tuple of tokens from tex
-        (after deleting extraneous brackets starting at pos) and delta
-        is the length of the tokens prior to bracket deletion.
-        """
-        t = self[offset]
+    def chunk(self,t):
+        """Convert the tokens starting with t to an output string and drop them.
+        Conversions of a token, or a token and its argument, are looked
+        up in _chunks first; an argument in braces is not, since the
+        key only has its first token."""
+        if t == '\\mbox' or t == '$' or ((t in _l2u_pairs or t in _accent_marks) and self[1] == '{'):
+            output, delta = self.convert(t)
+        else:
+            if t in _l2u_pairs:
+                key = (t,self[1])
+            else:
+                key = t
+            hit = self.chunks.get(key)
+            if hit is None:
+                _chunk_counts[1] += 1
+                output, delta = self.convert(t)
+                if len(self.chunks) < _chunks_limit:
+                    self.chunks[key] = output, delta
+            else:
+                _chunk_counts[0] += 1
+                output, delta = hit
+        del self.tex[:delta]
+        del self.starts[:delta]
+        return output
+
+    def convert(self,t):
+        """Convert the tokens starting with t to an output string and
+        the number of tokens it takes.
+        Tries the token with its argument, then the token alone; a token
+        sequence $x$ is only tried as a whole.  \\mbox is skipped, and
+        \\mbox{$x$} is taken like $x$."""
+        delta = 0
+        while t == '\\mbox':
+            delta += 1
+            t = self[delta]
+        code = None
         if t in _blacklist:
-            return
-        elif t == '':
-            for delta,c in self.candidates(offset+1):
-                if self[offset+delta+1] == '}':
-                    yield delta+2,c
-        elif t == '\\mbox':
-            for delta,c in self.candidates(offset+1):
-                yield delta+1,c
-        elif t == '$' and self[offset+2] == '$':
-            yield 3, (t,self[offset+1],t)
+            pass
+        elif t == '$' and self[delta+2] == '$':
+            code = _l2u_math.get(self[delta+1])
+            delta += 3
+        elif (delta and t == '{' and self[delta+1] == '$' and self[delta+3] == '$'
+                and self[delta+2] in _l2u_math and (self[delta+4] or ' ')[0] == '}'):
+            if len(self[delta+4]) > 1:
+                self.split(delta+4,1)   # text after the closing brace
+            code = _l2u_math[self[delta+2]]
+            delta += 5
         else:
-            q = self[offset+1]
-            if q == '' and self[offset+3] == '}':
-                yield 4, (t,self[offset+2])
-            elif q:
-                yield 2, (t,q)
-            yield 1, t
+            if t in _accent_marks and self[delta+1] == '{':
+                code, end = self.accent(t,delta+1)
+                if code is not None:
+                    return unichr(code), end
+            pairs = _l2u_pairs.get(t)
+            if pairs:
+                q = self[delta+1]
+                code = pairs.get(q)
+                if code is None and q == 'i':
+                    code = pairs.get('\\i')     # correct failure to undot i
+                if code is not None:
+                    delta += 2
+            if code is None:
+                code = _l2u.get(t)
+                if code is None and len(t) == 2 and t[1] == 'i':
+                    code = _l2u_pairs.get(t[0],{}).get('\\i')
+                delta += 1
+
+        if code is None:
+            # nothing matches, just pass through token as-is
+            return self.tex[0], 1
+        return unichr(code), delta
+
+    def split(self,n,i):
+        """Split the token at offset n after its first i characters."""
+        tok = self.tex[n]
+        self.tex[n:n+1] = [tok[:i], tok[i:]]
+        self.starts[n+1:n+1] = [self.starts[n] + i]
+
+    def accent(self,t,n):
+        """Convert accent t with its argument in braces at offset n, from
+        the table or by putting the accent on the converted argument.
+        Returns the code or None and the offset after the closing brace.
+        A run of plain characters that goes on after the closing brace
+        is split there."""
+        inner = []
+        depth = 0
+        while 1:
+            n += 1
+            tok = self[n]
+            if tok is None or len(inner) > 8:
+                return None, n
+            if tok == '{':
+                depth += 1
+            elif tok[0] != '\\' and '}' in tok:
+                for i in range(len(tok)):
+                    if tok[i] == '}':
+                        depth -= 1
+                        if depth < 0:
+                            break
+                if depth < 0:
+                    if i < len(tok) - 1:
+                        self.split(n,i+1)
+                        tok = tok[:i+1]
+                    if tok[:-1]:
+                        inner.append(tok[:-1])
+                    break
+            inner.append(tok)
+        n += 1
+        if not inner:
+            return _l2u.get((t,'{','}')), n
+        if len(inner) == 1:
+            pairs = _l2u_pairs.get(t,{})
+            code = pairs.get(inner[0])
+            if code is None and inner[0] == 'i':
+                code = pairs.get('\\i')
+            if code is not None:
+                return code, n
+        base = u''.join(map(unicode,_unlatex(inner[0][:0].join(inner))))
+        base = _dotless.get(base,base)
+        letter = unicodedata.normalize('NFC',base + unichr(_accent_marks[t]))
+        if len(base) != 1 or len(letter) != 1:
+            return None, n
+        return ord(letter), n
 
 latex_equivalents = {
     0x0009: ' ',
@@ -483,49 +884,238 @@ _ignore = Set([chr(i) for i in range(32)+[127]]) - Set('\t\n\r')
 # Regexp of chars not in blacklist, for quick start of tokenize
 _stoppers = re.compile('[\x00-\x1f!$\\-?\\{~\\\\`\']')
 
-_blacklist = Set(' \n\r')
-_blacklist.add(None)    # shortcut candidate generation at end of data
+# Tokenizer regexps for _token_spans.  A token is preceded by control
+# characters to be ignored; csnames and control symbols swallow the
+# blanks after them.  The last alternative matches a single character
+# and the run of plain characters that follows it.
+_token_pattern = r"""[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]*(?:
+    (\\(?:char|accent)%(digit)s+)
+  | (\\(?:%(alpha)s+|.)?)\s*
+  | (\$\$|/~|%(digit)s+|-+)
+  | ([^\x00-\x08\x0b\x0c\x0e-\x1f\x7f])([^\x00-\x1f\x7f!$\-?{~\\`'/%(digit_chars)s]*)
+)"""
+_tokens = re.compile(_token_pattern % {
+    'alpha': '[A-Za-z]', 'digit': '[0-9]', 'digit_chars': '0-9'}, re.VERBOSE | re.DOTALL)
+_unicode_tokens = re.compile(unicode(_token_pattern % {
+    'alpha': r'[^\W\d_\xb2\xb3\xb9\xbc-\xbe]',
+    'digit': r'[\d\xb2\xb3\xb9]', 'digit_chars': r'\d\xb2\xb3\xb9'}), re.VERBOSE | re.DOTALL | re.UNICODE)
+_non_latin1 = re.compile(u'[^\x00-\xff]')
 
-# Construction of inverse translation table
-_l2u = {
-    '\ ':ord(' ')   # unexpanding space makes no sense in non-TeX contexts
+# Accents for the generated entries, by combining character.  Accents
+# named by a letter take their argument in braces; i and j lose their
+# dot under accents above them.
+_accents = {
+    0x0300: '`', 0x0301: "'", 0x0302: '^', 0x0303: '~', 0x0304: '=',
+    0x0306: 'u', 0x0307: '.', 0x0308: '"', 0x030a: 'r', 0x030b: 'H',
+    0x030c: 'v', 0x0323: 'd', 0x0327: 'c', 0x0328: 'k', 0x0331: 'b',
 }
+_accents_below = Set([0x0323, 0x0327, 0x0328, 0x0331])
 
-for _tex in latex_equivalents:
-    if _tex <= 0x0020 or (_tex <= 0x007f and len(latex_equivalents[_tex]) <= 1):
-        continue    # boring entry
-    _toks = tuple(_tokenize(latex_equivalents[_tex]))
-    if _toks[0] == '' and _toks[-1] == '}':
-        _toks = _toks[1:-1]
-    if _toks[0].isalpha():
-        continue    # don't turn ligatures into single chars
-    if len(_toks) == 1 and (_toks[0] == "'" or _toks[0] == "`"):
-        continue    # don't turn ascii quotes into curly quotes
-    if _toks[0] == '\\mbox' and _toks[1] == '' and _toks[-1] == '}':
-        _toks = _toks[2:-1]
-    if len(_toks) == 4 and _toks[1] == '' and _toks[3] == '}':
-        _toks = (_toks[0],_toks[2])
-    if len(_toks) == 1:
-        _toks = _toks[0]
-    _l2u[_toks] = _tex
-
-# Shortcut candidate generation for certain useless candidates:
-# a character is in _blacklist if it can not be at the start
-# of any translation in _l2u.  We use this to quickly skip through
-# such characters before getting to more difficult-translate parts.
-# _blacklist is defined several lines up from here because it must
-# be defined in order to call _tokenize, however it is safe to
-# delay filling it out until now.
-
-for i in range(0x0020,0x007f):
-    _blacklist.add(chr(i))
-_blacklist.remove('{')
-_blacklist.remove('$')
-for candidate in _l2u:
-    if isinstance(candidate,tuple):
-        if not candidate or not candidate[0]:
-            continue
-        firstchar = candidate[0][0]
+# For decoding an accent with its argument in braces: the combining
+# character of each accent command, and dotless i and j to put it on
+_accent_marks = dict([('\\' + accent, mark) for mark, accent in _accents.items()])
+_dotless = {u'\u0131': u'i', u'\u0237': u'j'}
+
+# Greek letters known to TeX by their Unicode name, exceptions, and
+# capitals that TeX writes as Latin letters
+_greek = Set('alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu '
+    'xi pi rho sigma tau upsilon phi chi psi omega'.split())
+_greek_capitals = Set('Gamma Delta Theta Lambda Xi Pi Sigma Upsilon Phi Psi Omega'.split())
+_greek_special = {
+    0x0391: 'A', 0x0392: 'B', 0x0395: 'E', 0x0396: 'Z', 0x0397: 'H', 0x0399: 'I',
+    0x039a: 'K', 0x039c: 'M', 0x039d: 'N', 0x039f: 'O', 0x03a1: 'P', 0x03a4: 'T',
+    0x03a7: 'X', 0x03bf: 'o',
+    0x03b5: '\\mbox{$\\varepsilon$}', 0x03c2: '\\mbox{$\\varsigma$}',
+    0x03c6: '\\mbox{$\\varphi$}', 0x03d1: '\\mbox{$\\vartheta$}',
+    0x03d5: '\\mbox{$\\phi$}', 0x03d6: '\\mbox{$\\varpi$}',
+    0x03f1: '\\mbox{$\\varrho$}', 0x03f5: '\\mbox{$\\epsilon$}',
+}
+
+# Math symbols, written as \mbox{$\name$}
+_math = {
+    0x2032: 'prime', 0x2111: 'Im', 0x2113: 'ell', 0x2118: 'wp', 0x211c: 'Re',
+    0x2135: 'aleph', 0x2190: 'leftarrow', 0x2191: 'uparrow', 0x2192: 'rightarrow',
+    0x2193: 'downarrow', 0x2194: 'leftrightarrow', 0x2195: 'updownarrow',
+    0x21a6: 'mapsto', 0x21d0: 'Leftarrow', 0x21d1: 'Uparrow', 0x21d2: 'Rightarrow',
+    0x21d3: 'Downarrow', 0x21d4: 'Leftrightarrow', 0x2200: 'forall', 0x2202: 'partial',
+    0x2203: 'exists', 0x2205: 'emptyset', 0x2207: 'nabla', 0x2208: 'in',
+    0x2209: 'notin', 0x220b: 'ni', 0x220f: 'prod', 0x2210: 'coprod', 0x2211: 'sum',
+    0x2213: 'mp', 0x2217: 'ast', 0x2218: 'circ', 0x2219: 'bullet', 0x221a: 'surd',
+    0x221d: 'propto', 0x221e: 'infty', 0x2220: 'angle', 0x2223: 'mid',
+    0x2225: 'parallel', 0x2227: 'wedge', 0x2228: 'vee', 0x2229: 'cap', 0x222a: 'cup',
+    0x222b: 'int', 0x222e: 'oint', 0x223c: 'sim', 0x2243: 'simeq', 0x2245: 'cong',
+    0x2248: 'approx', 0x2260: 'neq', 0x2261: 'equiv', 0x2264: 'leq', 0x2265: 'geq',
+    0x226a: 'll', 0x226b: 'gg', 0x227a: 'prec', 0x227b: 'succ', 0x2282: 'subset',
+    0x2283: 'supset', 0x2286: 'subseteq', 0x2287: 'supseteq', 0x2295: 'oplus',
+    0x2296: 'ominus', 0x2297: 'otimes', 0x2298: 'oslash', 0x2299: 'odot',
+    0x22a2: 'vdash', 0x22a3: 'dashv', 0x22a4: 'top', 0x22a5: 'perp', 0x22c4: 'diamond',
+    0x22c5: 'cdot', 0x22c6: 'star', 0x22ee: 'vdots', 0x22ef: 'cdots', 0x2308: 'lceil',
+    0x2309: 'rceil', 0x230a: 'lfloor', 0x230b: 'rfloor', 0x2329: 'langle',
+    0x232a: 'rangle', 0x25b3: 'bigtriangleup', 0x25bd: 'bigtriangledown',
+    0x2660: 'spadesuit', 0x2661: 'heartsuit', 0x2662: 'diamondsuit', 0x2663: 'clubsuit',
+    0x266d: 'flat', 0x266e: 'natural', 0x266f: 'sharp',
+}
+
+def _accented(code,taken={}):
+    """LaTeX for a letter with accents, from its Unicode decomposition.
+    LaTeX that taken (latex_equivalents inverted) has for another
+    character is not used, not even inside another accent."""
+    d = unicodedata.decomposition(unichr(code)).split()
+    if len(d) != 2 or d[0].startswith('<') or int(d[1],16) not in _accents:
+        return None
+    base, mark = int(d[0],16), int(d[1],16)
+    accent = _accents[mark]
+    if base >= 0x80:
+        inner = _accented(base,taken)
+        if inner is None:
+            return None
+        tex = '\\%s{%s}' % (accent, inner)
+    elif not chr(base).isalpha():
+        return None
     else:
-        firstchar = candidate[0]
-    _blacklist.discard(firstchar)
+        inner = chr(base)
+        if inner in 'ij' and mark not in _accents_below:
+            inner = '\\' + inner
+        if accent.isalpha():
+            tex = '\\%s{%s}' % (accent, inner)
+        else:
+            tex = '\\%s%s' % (accent, inner)
+    if taken.get(tex,code) != code:
+        return None
+    return tex
+
+def _generate():
+    """Entries for characters latex_equivalents does not cover:
+    accented letters, Greek and math symbols.  LaTeX that latex_equivalents
+    already has for another character is left out, since it would decode
+    to that one; only Greek capitals written as Latin letters are meant
+    not to come back."""
+    table = {}
+    taken = dict([(tex,code) for code,tex in latex_equivalents.items()])
+    for code in range(0x00c0,0x0250) + range(0x1e00,0x1f00):
+        tex = _accented(code,taken)
+        if tex:
+            table[code] = tex
+    for code in range(0x0391,0x03fc):
+        if code in _greek_special:
+            table[code] = _greek_special[code]
+            continue
+        name = unicodedata.name(unichr(code),'').split()
+        if len(name) != 4 or name[:3] not in (['GREEK','SMALL','LETTER'],['GREEK','CAPITAL','LETTER']):
+            continue
+        letter = name[3].lower().replace('lamda','lambda')
+        if name[1] == 'CAPITAL':
+            letter = letter.capitalize()
+        if letter in _greek or letter in _greek_capitals:
+            table[code] = '\\mbox{$\\%s$}' % letter
+    for code in _math:
+        table[code] = '\\mbox{$\\%s$}' % _math[code]
+    for code,tex in table.items():
+        if taken.get(tex,code) != code and not tex.isalpha():
+            del table[code]
+    return table
+
+def _decode_tables(table):
+    """Build the decoding tables from a table like latex_equivalents:
+    _l2u, _l2u_pairs, _l2u_math and _blacklist."""
+    blacklist = Set(' \n\r')
+    blacklist.add(None)    # shortcut candidate generation at end of data
+
+    # Construction of inverse translation table; entries of
+    # latex_equivalents come last, so they win over generated ones
+    l2u = {
+        '\ ':ord(' ')   # unexpanding space makes no sense in non-TeX contexts
+    }
+    entries = [(code,tex) for code,tex in table.items() if code not in latex_equivalents]
+    for tex,tex_string in entries + latex_equivalents.items():
+        if tex <= 0x0020 or (tex <= 0x007f and len(tex_string) <= 1):
+            continue    # boring entry
+        toks = tuple(_tokenize(tex_string))
+        if toks[0] == '{' and toks[-1] == '}':
+            toks = toks[1:-1]
+        if toks[0].isalpha():
+            continue    # don't turn ligatures into single chars
+        if len(toks) == 1 and (toks[0] == "'" or toks[0] == "`"):
+            continue    # don't turn ascii quotes into curly quotes
+        if toks[0] == '\\mbox' and toks[1] == '{' and toks[-1] == '}':
+            toks = toks[2:-1]
+        if len(toks) == 4 and toks[1] == '{' and toks[3] == '}':
+            toks = (toks[0],toks[2])
+        if len(toks) == 1:
+            toks = toks[0]
+        l2u[toks] = tex
+
+    # The decoder looks up pairs (token,argument) and math $x$ in
+    # separate tables, keyed by their first token and by x.
+    pairs = {}
+    math = {}
+    for toks in l2u:
+        if isinstance(toks,tuple) and len(toks) == 2:
+            pairs.setdefault(toks[0],{})[toks[1]] = l2u[toks]
+        elif isinstance(toks,tuple) and len(toks) == 3 and toks[0] == toks[2] == '$':
+            math[toks[1]] = l2u[toks]
+
+    # Shortcut candidate generation for certain useless candidates:
+    # a character is in _blacklist if it can not be at the start
+    # of any translation in _l2u.  We use this to quickly skip through
+    # such characters before getting to more difficult-translate parts.
+    for i in range(0x0020,0x007f):
+        blacklist.add(chr(i))
+    blacklist.remove('{')
+    blacklist.remove('$')
+    for candidate in l2u:
+        if isinstance(candidate,tuple):
+            if not candidate or not candidate[0]:
+                continue
+            firstchar = candidate[0][0]
+        else:
+            firstchar = candidate[0]
+        blacklist.discard(firstchar)
+    return l2u, pairs, math, frozenset(blacklist)   # faster to look up than a Set
+
+# Change _tables_version whenever _generate or _decode_tables change,
+# so that old caches are not used any more.
+_tables_version = 2
+_tables_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),'latex.tables')
+_equivalents = _l2u = _l2u_pairs = _l2u_math = _blacklist = None
+
+def _load_tables():
+    """Set the extended table and the decoding tables, from the cache
+    file if it is up to date, else build them and try to save them."""
+    global _equivalents, _l2u, _l2u_pairs, _l2u_math, _blacklist
+    key = (_tables_version, unicodedata.unidata_version,
+        hashlib.md5(repr(sorted(latex_equivalents.items()))).hexdigest())
+    try:
+        f = open(_tables_file,'rb')
+        try:
+            data = marshal.load(f)
+        finally:
+            f.close()
+        if data[0] == key:
+            _equivalents, _l2u, _l2u_pairs, _l2u_math, _blacklist = data[1:]
+            return
+    except (IOError, EOFError, ValueError, TypeError, IndexError):
+        pass
+
+    equivalents = _generate()
+    equivalents.update(latex_equivalents)
+    l2u, pairs, math, blacklist = _decode_tables(equivalents)
+    try:
+        temp = '%s.%d' % (_tables_file, os.getpid())
+        f = open(temp,'wb')
+        try:
+            marshal.dump((key, equivalents, l2u, pairs, math, blacklist), f)
+        finally:
+            f.close()
+        os.rename(temp,_tables_file)
+    except (IOError, OSError):
+        pass    # no cache then
+    _equivalents, _l2u, _l2u_pairs, _l2u_math, _blacklist = equivalents, l2u, pairs, math, blacklist
+
+def equivalents():
+    """latex_equivalents, extended by generated entries for accented
+    letters, Greek and math symbols (those of latex_equivalents win).
+    This is what encoding uses."""
+    if _equivalents is None:
+        _load_tables()
+    return _equivalents
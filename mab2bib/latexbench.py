@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Prüfkorpus und Benchmarks für den latex-Codec (latex.py)
+
+Aufruf:
+  [python] latexbench.py check [<Golden-Datei>]
+      kodiert und dekodiert das Korpus und vergleicht mit den gespeicherten
+      Ergebnissen (latex_golden.json); Abweichungen werden aufgelistet
+  [python] latexbench.py update [<Golden-Datei>]
+      speichert die aktuellen Ergebnisse als neue Golden-Datei
+      (nur nach einer gewollten Änderung des Codecs!)
+  [python] latexbench.py run [Optionen] [<BibTeX-Datei>]
+      misst Kodieren und Dekodieren mit latex und latex+latin1 in MB/s
+      (bezogen auf die Größe des LaTeX-Textes); mit BibTeX-Datei auch
+      das Dekodieren dieser Datei (latex+latin1) mit und ohne den Cache
+      der dekodierten Befehle
+
+Das Korpus enthält jedes Zeichen aus latex.equivalents(), Text in
+verschiedenen Schriften, \\char, Akzente wie \\"{a}, \\"a und {\\"a} sowie
+Formeln in $...$. Dekodiert wird auch stückweise (IncrementalDecoder),
+das Ergebnis muss dem Dekodieren am Stück gleichen. Jedes erzeugte
+Zeichen (nicht aus latex_equivalents) muss kodiert und dekodiert wieder
+dasselbe ergeben, außer griechischen Großbuchstaben, die als lateinische
+geschrieben werden. Außerdem muss
+utf8_to_latex.py, als latex_to_utf8.py aufgerufen, eine Datei mit
+Absätzen genauso umsetzen wie das zeilenweise Dekodieren. Liegt
+mab2bib in der Sammlung, müssen utf8_to_latex.py und treewalk.py
+dieselben Bytes haben wie latin1_to_utf8.py und treewalk.py dort.
+
+Optionen:
+--size=MB       Textmenge für die Messung (1)
+--repeat=N      jede Messung N-mal, gewertet wird die schnellste (3)
+--output=<JSON-Datei>
+                Ergebnisse als JSON speichern (sonst nur Ausgabe)
+
+Die Datei latex.py muss im gleichen Verzeichnis liegen!
+"""
+
+import os, sys, time, getopt, codecs, shutil, platform, tempfile, subprocess, json
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import latex
+latex.register()
+
+verzeichnis = os.path.dirname(os.path.abspath(__file__))
+golden = os.path.join(verzeichnis, 'latex_golden.json')
+encodings = ('latex', 'latex+latin1')
+
+saetze = [
+    u'Müller, Jürgen: Über die Straße. Größe und Maß im Mittelalter.',
+    u'Schrödinger – Briefe an Bärbel (1926–1961), hg. v. René François.',
+    u'Ça va? ¡Olé! «Les Misérables», Œuvres complètes, tome Ⅲ.',
+    u'Łódź, Kraków, Gdańsk – Dvořák, Janáček, Smetana; Ærø, Ångström, Søren.',
+    u'Ελληνικά: αβγδε, Ωμέγα. Русский: Москва, Чехов.',
+    u'中文 日本語 한국어 – ½ kg, 20 °C, ± 5 %, 3 × 4 ÷ 2, µm, ², ³.',
+    u'„Anführung“ ‚einfach‘ “English” ‘single’ … — † ‡ § ¶ © ® ™ € £ ¥.',
+    u'İstanbul, ığdır, ſ, ﬁ, ß, ẞ, ǅ, ŉ, ĳ, Ŋ, ŧ.',
+]
+
+dekodieren = [
+    # Akzente in allen Schreibweisen
+    '\\"{a}', '\\"a', '{\\"a}', '\\" a', '\\"{}', '\\"A\\"O\\"U\\"a\\"o\\"u\\ss',
+    "\\'{e}", "\\'e", "{\\'e}", "\\'{\\i}", "\\'\\i", "\\'i", '\\`\\i', '\\^{\\i}',
+    '\\c{c}', '\\c c', '{\\c c}', '\\v{c}', '\\v c', '\\v{C}', '\\u{a}', '\\=a', '\\.z',
+    '\\H{o}', '\\r{u}', '\\~n', '\\^o', '\\`a', '\\k{a}',
+    '\\ss b', '\\ss{}b', '{\\ss}b', '\\o', '\\O', '\\aa', '\\AA', '\\ae', '\\AE',
+    '\\oe', '\\OE', '\\l', '\\L', '\\i', '\\j',
+    # \char
+    '\\char228', '{\\char228}', '\\char 228', '\\char"E4', "\\char'344", '\\accent127a',
+    # Formeln
+    '$\\pm$', '$x$', '$$x$$', '$\\alpha$', '$^2$', '\\mbox{$\\times$}', '\\mbox{$\\pm$}',
+    '$a$b$', '\\mbox\\mbox{\\"a}',
+    # Satzzeichen, Striche, URLs
+    '--', '---', '----', '!`', '?`', '``', "''", '`', "'", '~', 'a~b',
+    'http://host/~user/', '\\&', '\\#', '\\%', '\\$', '\\_', '\\{\\}', '\\\\', '\\ ', '\\-',
+    '\\dots', '\\ldots', '\\S', '\\P', '\\copyright', '\\pounds', '\\dag', '\\ddag',
+    # unbekannte Befehle und Steuerzeichen
+    '\\foo bar', '\\foo{bar}', '\\textit{M\\"uller}', 'a\x01b\x7fc', 'a\tb\r\nc',
+    # gemischt, auch mit Latin-1
+    '@book{m1,\n  author = {M\\"uller, J\\"urgen},\n  title = {\\"Uber die Stra\\ss e --- Gr\\"o\\ss e},\n}\n',
+    'M\xfcller \\"a \xdf \\ss{} \xe9 \\\'e',
+]
+
+def korpus():
+    """Liste der Fälle (Name, Art, Eingabe); Art ist 'encode' oder 'decode'"""
+    faelle = []
+    for code in sorted(latex.equivalents()):
+        faelle.append(('U+%04X' % code, 'encode', unichr(code)))
+        faelle.append(('U+%04X zwischen Buchstaben' % code, 'encode', u'a%sb' % unichr(code)))
+    for nummer, satz in enumerate(saetze):
+        faelle.append(('Satz %d' % (nummer + 1), 'encode', satz))
+    for code in (0x03b1, 0x4e2d, 0x20ac, 0x1d11e):
+        faelle.append(('\\char U+%04X' % code, 'encode', u'x%sy' % unichr(code)))
+    for tex in dekodieren:
+        faelle.append((tex.decode('latin-1'), 'decode', tex))
+    return faelle
+
+def versuche(funktion, *args):
+    "Ergebnis als Unicode oder Fehlermeldung"
+    try:
+        ergebnis = funktion(*args)
+    except Exception, ex:
+        return u'Fehler: %s' % ex.__class__.__name__
+    if isinstance(ergebnis, str):
+        ergebnis = ergebnis.decode('latin-1')
+    return ergebnis
+
+def stueckweise(tex, encoding, groesse):
+    "Dekodieren mit dem IncrementalDecoder in Stücken von groesse Bytes"
+    decoder = codecs.getincrementaldecoder(encoding)()
+    teile = [decoder.decode(tex[i:i+groesse]) for i in range(0, len(tex), groesse)]
+    return u''.join(teile) + decoder.decode('', True)
+
+def ergebnisse():
+    """Ergebnisse aller Fälle des Korpus als Liste von dicts"""
+    liste = []
+    for name, art, eingabe in korpus():
+        fall = {'name': name, 'type': art}
+        if art == 'encode':
+            fall['input'] = eingabe
+            for encoding in encodings:
+                fall[encoding] = versuche(eingabe.encode, encoding)
+                fall[encoding + ' decoded'] = versuche(
+                    lambda: eingabe.encode(encoding).decode(encoding))
+        else:
+            fall['input'] = eingabe.decode('latin-1')
+            for encoding in encodings:
+                ganz = fall[encoding] = versuche(eingabe.decode, encoding)
+                for groesse in (1, 3):
+                    if versuche(stueckweise, eingabe, encoding, groesse) != ganz:
+                        fall[encoding + ' chunked'] = u'weicht ab (%d Bytes)' % groesse
+        liste.append(fall)
+    return liste
+
+def check_rundweg():
+    """Kodiert und dekodiert jedes erzeugte Zeichen von latex.equivalents();
+    liefert die Zahl der Zeichen, die nicht wiederkommen"""
+    fehler = 0
+    for code, tex in sorted(latex.equivalents().items()):
+        if code in latex.latex_equivalents or tex.isalpha():
+            continue
+        for encoding in encodings:
+            zurueck = versuche(lambda: unichr(code).encode(encoding).decode(encoding))
+            if zurueck != unichr(code):
+                print "U+%04X %s: %r wird zu %r" % (code, encoding, tex, zurueck)
+                fehler += 1
+    return fehler
+
+def absaetze():
+    """LaTeX-Text mit Absätzen aus den Dekodier-Fällen und den kodierten
+    Sätzen; viele Zeilen enden mit einem Befehl vor einer Leerzeile"""
+    zeilen = []
+    for tex in dekodieren + [satz.encode('latex') for satz in saetze]:
+        if versuche(tex.decode, 'latex').startswith(u'Fehler: '):
+            continue
+        zeilen.extend([tex, 'Zeile mit \\ss', '', '\\"a \\foo', '\t', 'Absatz \\i', '', ''])
+    return '\n'.join(zeilen) + '\n'
+
+def check_datei():
+    """Setzt absaetze() mit utf8_to_latex.py als latex_to_utf8.py um und
+    vergleicht mit dem zeilenweisen Dekodieren; liefert die Zahl der
+    abweichenden Zeilen"""
+    temp = tempfile.mkdtemp()
+    try:
+        quelle, ziel = os.path.join(temp, 'absaetze.tex'), os.path.join(temp, 'absaetze.txt')
+        open(quelle, 'wb').write(absaetze())
+        skript = os.path.join(temp, 'latex_to_utf8.py')
+        shutil.copy(os.path.join(verzeichnis, 'utf8_to_latex.py'), skript)
+        ausgabe = open(os.devnull, 'w')
+        subprocess.call([sys.executable, skript, '--overwrite', quelle, ziel], stdout=ausgabe,
+            env=dict(os.environ, PYTHONPATH=verzeichnis))
+        ausgabe.close()
+        erwartet = ''.join([unicode(zeile, 'latex').encode('utf-8') for zeile in open(quelle, 'rU')])
+        erhalten = os.path.exists(ziel) and open(ziel, 'rb').read() or ''
+    finally:
+        shutil.rmtree(temp)
+    abweichungen = 0
+    erwartet, erhalten = erwartet.splitlines(True), erhalten.splitlines(True)
+    for nummer in range(max(len(erwartet), len(erhalten))):
+        alt, neu = erwartet[nummer:nummer+1], erhalten[nummer:nummer+1]
+        if alt != neu:
+            print "latex_to_utf8 Zeile %d:\n  erwartet %r\n  erhalten %r" % (nummer + 1, alt, neu)
+            abweichungen += 1
+    return abweichungen
+
+# Kopien aus der Sammlung (eine Ebene höher): Kopie -> Original
+kopien = {'utf8_to_latex.py': 'latin1_to_utf8.py', 'treewalk.py': 'treewalk.py'}
+
+def check_kopien():
+    """Vergleicht die Kopien mit den Dateien der Sammlung, falls es sie
+    gibt; liefert die Zahl der abweichenden Kopien"""
+    abweichungen = 0
+    for kopie, original in sorted(kopien.items()):
+        original = os.path.join(verzeichnis, os.pardir, original)
+        if not os.path.isfile(original):
+            continue                    # mab2bib allein
+        if open(os.path.join(verzeichnis, kopie), 'rb').read() != open(original, 'rb').read():
+            print "%s weicht von %s ab (neu kopieren)" % (kopie, os.path.normpath(original))
+            abweichungen += 1
+    return abweichungen
+
+def check(dateiname):
+    """Vergleicht mit der Golden-Datei, liefert die Zahl der Abweichungen"""
+    erwartet = dict([(fall['name'], fall) for fall in json.load(open(dateiname))])
+    abweichungen = 0
+    aktuell = ergebnisse()
+    for fall in aktuell:
+        alt = erwartet.pop(fall['name'], None)
+        if alt is None:
+            print "neu: %r" % fall['name']
+            abweichungen += 1
+            continue
+        for schluessel in sorted(set(fall) | set(alt)):
+            if fall.get(schluessel) != alt.get(schluessel):
+                print "%r %s:\n  erwartet %r\n  erhalten %r" % (
+                    fall['name'], schluessel, alt.get(schluessel), fall.get(schluessel))
+                abweichungen += 1
+    for name in sorted(erwartet):
+        print "fehlt: %r" % name
+        abweichungen += 1
+    abweichungen += check_rundweg()
+    abweichungen += check_datei()
+    abweichungen += check_kopien()
+    print "%d Fälle, %d Abweichungen" % (len(aktuell), abweichungen)
+    return abweichungen
+
+def update(dateiname):
+    liste = ergebnisse()
+    text = json.dumps(liste, indent=1, sort_keys=True, separators=(',', ': '))
+    datei = open(dateiname, 'w')
+    datei.write(text + '\n')
+    datei.close()
+    print "%s: %d Fälle" % (dateiname, len(liste))
+
+def messe(funktion, wiederholungen):
+    "schnellste von wiederholungen Laufzeiten in Sekunden"
+    zeiten = []
+    for i in range(wiederholungen):
+        start = time.time()
+        funktion()
+        zeiten.append(time.time() - start)
+    return min(zeiten)
+
+def cache_aus():
+    "Dekodieren ohne Cache"
+    latex.decode_cache_clear()
+    latex._chunks_limit, limit = 0, latex._chunks_limit
+    return limit
+
+def run(megabytes=1, wiederholungen=3, bibname=None):
+    """Misst Kodieren und Dekodieren mit latex und latex+latin1"""
+    text = u'\n'.join(saetze[:4])
+    text = text * int(megabytes * 2**20 / len(text.encode('latex')) + 1)
+    ergebnisse = []
+    for encoding in encodings:
+        tex = text.encode(encoding)
+        for name, funktion in (
+                ('encode', lambda: text.encode(encoding)),
+                ('decode', lambda: tex.decode(encoding))):
+            sekunden = messe(funktion, wiederholungen)
+            mbs = len(tex) / 2.0**20 / max(sekunden, 1e-9)
+            ergebnisse.append({
+                'benchmark': '%s %s' % (name, encoding),
+                'bytes': len(tex),
+                'seconds': round(sekunden, 4),
+                'mb_per_second': round(mbs, 2),
+            })
+            print "%-20s %9d Bytes in %7.3f s = %7.2f MB/s" % (
+                '%s %s' % (name, encoding), len(tex), sekunden, mbs)
+    if bibname:
+        tex = open(bibname, 'rb').read()
+        limit = cache_aus()
+        for name in ('decode-bib-uncached', 'decode-bib'):
+            latex.decode_cache_clear()
+            sekunden = messe(lambda: tex.decode('latex+latin1'), wiederholungen)
+            mbs = len(tex) / 2.0**20 / max(sekunden, 1e-9)
+            ergebnisse.append({
+                'benchmark': name,
+                'bytes': len(tex),
+                'seconds': round(sekunden, 4),
+                'mb_per_second': round(mbs, 2),
+            })
+            print "%-20s %9d Bytes in %7.3f s = %7.2f MB/s" % (name, len(tex), sekunden, mbs)
+            latex._chunks_limit = limit
+        treffer, fehlgriffe, eintraege = latex.decode_cache_info()
+        print "Cache: %d Treffer, %d Fehlgriffe, %d Einträge" % (treffer, fehlgriffe, eintraege)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': ergebnisse,
+    }
+
+def help(message=""):
+    print message
+    print __doc__
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "s:r:o:", ["size=", "repeat=", "output="])
+    except getopt.GetoptError, ex:
+        help(ex)
+    if not args or args[0] not in ('check', 'update', 'run'):
+        help()
+    megabytes, wiederholungen, ausgabe = 1, 3, None
+    for (o, a) in opts:
+        if o in ('-s', '--size'):
+            megabytes = float(a)
+        elif o in ('-r', '--repeat'):
+            wiederholungen = int(a)
+        elif o in ('-o', '--output'):
+            ausgabe = a
+
+    if args[0] == 'check':
+        if len(args) > 1:
+            golden = args[1]
+        if not os.path.isfile(golden):
+            help("Golden-Datei '%s' nicht gefunden!" % golden)
+        sys.exit(check(golden) and 1 or 0)
+    elif args[0] == 'update':
+        if len(args) > 1:
+            golden = args[1]
+        update(golden)
+    else:
+        if len(args) > 1 and not os.path.isfile(args[1]):
+            help("BibTeX-Datei '%s' nicht gefunden!" % args[1])
+        ergebnis = run(megabytes, wiederholungen, args[1:] and args[1] or None)
+        if ausgabe:
+            json.dump(ergebnis, open(ausgabe, 'w'), indent=2)
@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 """Konvertierung vom MAB-Format in das BibTeX-Format
 """
-import os.path, sys, re, string, codecs, latex
+import os.path, sys, re, string, codecs, locale, getopt, mmap, sqlite3, hashlib, json, tempfile, unicodedata, latex
+from collections import OrderedDict
+latex.register()
 
 AppInfo = """
 MAB2Bib 0.2a : bibliographischer Konverter von MAB nach BibTeX
@@ -13,17 +15,217 @@ LaTeX-Codec von D. Eppstein
 Lizenz: Python-Lizenz (http://python.org/doc/Copyright.html)
 """
 
-AppHelp = """Aufruf: [python] mab2bib.py <MAB-Datei> [<BibTeX-Datei>]
+AppHelp = """Aufruf: [python] mab2bib.py [Optionen] <MAB-Datei> [<BibTeX-Datei>]
+        [python] mab2bib.py [Optionen] --output=<BibTeX-Datei> <MAB-Datei> ...
 Ist keine Ausgabedatei angegeben, wird an die Eingabedatei '.bib' angehängt.
 
+Optionen:
+--jobs=N    Konvertierung auf N Prozesse verteilen (nur eine MAB-Datei
+            nach BibTeX, nicht mit --incremental, --formats, --dedup)
+--cache=N   höchstens N übersetzte Feldwerte zwischenspeichern (10000)
+--stats     Trefferquote des Übersetzungs-Caches ausgeben
+--incremental
+            nur seit dem letzten Lauf angehängte Datensätze konvertieren
+            (Checkpoint in <BibTeX-Datei>.ckpt; nur eine MAB-Datei nach
+            BibTeX, nicht mit --formats, --dedup)
+--output=<BibTeX-Datei>
+            alle angegebenen MAB-Dateien in eine BibTeX-Datei konvertieren
+--dedup     Dubletten (gleiche ISBN/ISSN oder Titel/Autor/Jahr) entfernen
+--dedup-limit=N
+            höchstens N Schlüssel im Speicher, darüber SQLite (1000000)
+--formats=bibtex,biblatex,csl,ris,sqlite
+            Ausgabeformate; außer BibTeX wird die Endung der BibTeX-Datei
+            ersetzt (.biblatex.bib, .json, .ris, .sqlite)
+--report=<JSON-Datei>
+            Probleme beim Einlesen (Anzahl je Art und Feld, Beispiele)
+            als JSON speichern
+--quiet     keine Zusammenfassung der Probleme ausgeben
+--index     nur den Index <MAB-Datei>.idx (neu) aufbauen
+--lookup=[id:|isbn:|titel:|jahr:]Wert
+            Datensätze über den Index suchen und als BibTeX ausgeben
+            (der Wert in der Kodierung des Terminals)
+
 Die Datei latex.py muss im gleichen Verzeichnis liegen!
 """
 
-class Datensatz(dict):
+class Diagnose(object):
+    """Sammelt Probleme beim Einlesen (unbekannte Schlüssel, ungültige Zeilen,
+    Dubletten), statt jedes einzeln auszugeben: gezählt nach Art und Feldcode,
+    mit höchstens beispiele Beispielen samt Datensatznummer je Art und Feld.
+    Je Art werden höchstens felder verschiedene Feldcodes gezählt, alle
+    weiteren zusammen unter '...'.
+    """
+
+    def __init__(self, beispiele=5, felder=20):
+        self.max_beispiele = beispiele
+        self.max_felder = felder
+        self.zaehler = {}
+        self.beispiele = {}
+        self.felder = {}    # Anzahl der Feldcodes je Art
+        self.dsno = None    # Nummer des Datensatzes, der gerade gelesen wird
+
+    def schluessel(self, art, feld):
+        "(art, feld) oder, wenn die Art schon genug Feldcodes hat, (art, '...')"
+        k = (art, feld)
+        if k not in self.zaehler:
+            if self.felder.get(art, 0) >= self.max_felder:
+                return (art, '...')
+            self.felder[art] = self.felder.get(art, 0) + 1
+        return k
+
+    def melde(self, art, feld, wert):
+        k = self.schluessel(art, feld)
+        anzahl = self.zaehler.get(k, 0)
+        self.zaehler[k] = anzahl + 1
+        if anzahl < self.max_beispiele:
+            self.beispiele.setdefault(k, []).append((self.dsno, wert))
+
+    def update(self, andere):
+        "Zählungen einer anderen Diagnose übernehmen (aus den Prozessen bei --jobs)"
+        for k, anzahl in sorted(andere.zaehler.items()):
+            neu = self.schluessel(*k)
+            self.zaehler[neu] = self.zaehler.get(neu, 0) + anzahl
+            beispiele = self.beispiele.setdefault(neu, [])
+            beispiele.extend(andere.beispiele.get(k, [])[:self.max_beispiele - len(beispiele)])
+
+    def __len__(self):
+        return sum(self.zaehler.values())
+
+    def zusammenfassung(self):
+        if not self.zaehler: return "Keine Probleme beim Einlesen"
+        erg = ["Probleme beim Einlesen: %d" % len(self)]
+        for k in sorted(self.zaehler.keys(), key=lambda k: (k[0], k[1] == '...', k[1])):
+            art, feld = k
+            erg.append("  %s %s: %d" % (art, feld, self.zaehler[k]))
+            for dsno, wert in self.beispiele.get(k, []):
+                erg.append("    Datensatz %s: %s" % (dsno, wert))
+        return string.join(erg, "\n")
+
+    def bericht(self, dateiname, encoding='latin-1'):
+        "Zählungen und Beispiele als JSON-Datei"
+        probleme = []
+        for k in sorted(self.zaehler.keys(), key=lambda k: (k[0], k[1] == '...', k[1])):
+            art, feld = k
+            probleme.append(OrderedDict([
+                ('art', art), ('feld', unicode(feld, encoding)), ('anzahl', self.zaehler[k]),
+                ('beispiele', [{'datensatz': dsno, 'wert': unicode(wert, encoding)}
+                    for dsno, wert in self.beispiele.get(k, [])]),
+            ]))
+        json.dump(OrderedDict([('gesamt', len(self)), ('probleme', probleme)]),
+            open(dateiname, 'w'), indent=2)
+
+
+class Uebersetzer(object):
+    """Übersetzung von MAB-Feldwerten in TeX, wie Datensatz.translate
+
+    Die Regeln werden einmal kompiliert und in derselben Reihenfolge wie
+    bisher angewandt (sie greifen ineinander, z.B. erzeugt das Löschen von
+    '&lt;' neue Leerzeichen oder Punktfolgen). Regeln ohne Regex-Zeichen
+    laufen über str.replace. Übersetzte Werte landen in einem LRU-Cache,
+    weil Verlag, Ort, Reihe usw. tausendfach wiederkehren.
+    Mit ziel=None wird nicht nach LaTeX codiert, sondern Unicode geliefert.
+    """
+
+    reRegex = re.compile(r'[\\.^$*+?{}\[\]|()]')
+
+    def __init__(self, regeln, groesse=10000, encoding='latin-1', ziel='latex'):
+        self.regeln = []
+        if hasattr(regeln, 'items'): regeln = regeln.items()
+        for muster, ersatz in regeln:
+            if self.reRegex.search(muster) or self.reRegex.search(ersatz):
+                self.regeln.append((re.compile(muster).sub, ersatz))
+            else:
+                self.regeln.append((None, (muster, ersatz)))
+        self.groesse = groesse
+        self.encoding = encoding
+        self.ziel = ziel
+        self.cache = OrderedDict()
+        self.treffer = 0
+        self.fehlschlaege = 0
+
+    def vorbereite(self, s):
+        "wendet die Regeln an und liefert Unicode, noch ohne Zielcodierung"
+        for sub, ersatz in self.regeln:
+            if sub is None:
+                if ersatz[0] in s:
+                    s = s.replace(*ersatz)
+            else:
+                s = sub(ersatz, s)
+        return unicode(string.strip(s), self.encoding)
+
+    def uebersetze(self, s):
+        "ohne Cache"
+        s = self.vorbereite(s)
+        if self.ziel:
+            s = s.encode(self.ziel)
+        return s
+
+    def alle(self, werte):
+        """wie [self(s) for s in werte], aber die neuen Werte werden
+        gemeinsam mit latex.encode_batch codiert"""
+        erg = [None] * len(werte)
+        neu = OrderedDict()     # Wert -> Positionen in erg
+        for i, s in enumerate(werte):
+            if s in neu:
+                neu[s].append(i)
+                self.treffer += 1
+            elif s in self.cache:
+                erg[i] = self.cache.pop(s)
+                self.cache[s] = erg[i]
+                self.treffer += 1
+            else:
+                neu[s] = [i]
+                self.fehlschlaege += 1
+        if not neu:
+            return erg
+        texte = [self.vorbereite(s) for s in neu]
+        if not self.ziel:
+            codiert = texte
+        elif self.ziel.startswith('latex'):
+            codiert = latex.encode_batch(texte, self.ziel)
+        else:
+            codiert = [t.encode(self.ziel) for t in texte]
+        for (s, positionen), c in zip(neu.items(), codiert):
+            for i in positionen:
+                erg[i] = c
+            if len(self.cache) >= self.groesse:
+                self.cache.popitem(last=False)
+            self.cache[s] = c
+        return erg
+
+    def __call__(self, s):
+        try:
+            erg = self.cache.pop(s)
+            self.treffer += 1
+        except KeyError:
+            self.fehlschlaege += 1
+            erg = self.uebersetze(s)
+            if len(self.cache) >= self.groesse:
+                self.cache.popitem(last=False)
+        self.cache[s] = erg
+        return erg
+
+    def trefferquote(self):
+        anfragen = self.treffer + self.fehlschlaege
+        if not anfragen: return 0.0
+        return 100.0 * self.treffer / anfragen
+
+    def statistik(self):
+        return "Übersetzungs-Cache: %d Treffer, %d Fehlschläge (%.1f %%), %d von %d Einträgen belegt" % (
+            self.treffer, self.fehlschlaege, self.trefferquote(), len(self.cache), self.groesse)
+
+
+class Datensatz(object):
     """Datensatz einer bibliografischen Datenbank
     Als Felder (Schlüssel) werden die MAB-felder verwendet, weil sie genauer sind
+
+    Verhält sich wie ein dict, speichert aber nur zwei parallele Listen
+    (internierte Feldcodes und Werte) in __slots__; ein Datensatz hat nur
+    wenige Felder, da ist die lineare Suche schneller als ein eigenes dict.
     """
 
+    __slots__ = ('schluessel', 'werte')
+
     # Zuordnung von MAB-Feldern auf BibTeX-Felder
     mab2bib = {
         'id' : None,
@@ -99,6 +301,15 @@ class Datensatz(dict):
         'series': '/',
     }
 
+    # Übersetzung von MAB-Zeichen in Text für Formate ohne TeX (CSL-JSON, RIS)
+    # in dieser Reihenfolge, Leerraum zuletzt zusammenfassen
+    text_trans = (
+        ('\xAC', ' '),
+        ('&lt;', ''),
+        ('&gt;', ''),
+        ('\s+', ' '),
+    )
+
     # Übersetzung von MAB-Zeichen in TeX-Zeichen
     # Achtung, reguläre Ausdrücke!
     # das meiste wird von latex.py erledigt!
@@ -112,52 +323,339 @@ class Datensatz(dict):
     }
 
     def __init__(self, *args, **kwargs):
-        dict.__init__(self, *args, **kwargs)
+        self.schluessel = []
+        self.werte = []
+        if args or kwargs:
+            self.update(dict(*args, **kwargs))
 
     def __setitem__(self, key, value):
-        if key in self.mab2bib.keys():
-            dict.__setitem__(self, key, value)
+        feld = self.feldcodes.get(key)
+        if feld is None:
+            self.diagnose.melde('unbekannter Schlüssel', key, value)
+        elif feld in self.schluessel:
+            self.werte[self.schluessel.index(feld)] = value
         else:
-            print "Unbekannter Schlüssel '%s' (Wert: '%s')" % (key, value)
+            self.schluessel.append(feld)
+            self.werte.append(value)
+
+    def __getitem__(self, key):
+        try:
+            return self.werte[self.schluessel.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.schluessel
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self.schluessel)
+
+    def __iter__(self):
+        return iter(self.schluessel)
+
+    def get(self, key, default=None):
+        if key in self.schluessel:
+            return self.werte[self.schluessel.index(key)]
+        return default
+
+    def keys(self):
+        return list(self.schluessel)
+
+    def values(self):
+        return list(self.werte)
+
+    def items(self):
+        return zip(self.schluessel, self.werte)
 
     def update(self, updatedict):
-        "überschrieben, damit das eigene __setitem__ verwendet wird"
+        "mit dem eigenen __setitem__"
         for key in updatedict.keys():
             self[key] = updatedict[key]
 
     def translate(self, s, table, deletechars=None):
-        "ersetzt Sonderzeichen usw.; ähnlich string.translate"
-        for k in self.tex_trans.keys():
-            s = re.sub(k, self.tex_trans[k], s)
-        s = unicode(string.strip(s), 'latin-1').encode('latex') # evtl. mac-roman
-        return s
+        """ersetzt Sonderzeichen usw.; ähnlich string.translate
+        s kann auch eine Liste von Werten sein, die werden gemeinsam übersetzt"""
+        if isinstance(s, list):
+            return self.uebersetzer.alle(s)
+        return self.uebersetzer(s)
 
-    def BibTeXdict(self):
-        btd = {}
-        felder = self.keys()
-        felder.sort()
-        for key in felder:
+    def felder(self):
+        """Rohwerte je BibTeX-Feld, {bkey: [Wert, ...]} in der Reihenfolge der MAB-Felder;
+        Grundlage für alle Ausgabeformate"""
+        fd = OrderedDict()
+        for key, wert in sorted(zip(self.schluessel, self.werte)):
             bkey = self.mab2bib[key]
             if not bkey: continue
-            val = self.translate(self[key], self.tex_trans)
-            if self.glue.has_key(bkey):
-                glue = self.glue[bkey]
-            else:
-                glue = self.glue['default']
-            if btd.has_key(bkey):
-                btd[bkey] = string.join((btd[bkey], val), glue)
+            if bkey in fd:
+                fd[bkey].append(wert)
             else:
-                btd[bkey] = val
+                fd[bkey] = [wert]
+        return fd
+
+    def BibTeXdict(self, felder=None, glue=None):
+        btd = {}
+        glue = glue or self.glue
+        if felder is None: felder = self.felder()
+        uebersetzt = iter(self.translate([w for werte in felder.values() for w in werte], self.tex_trans))
+        for bkey, werte in felder.items():
+            werte = [uebersetzt.next() for w in werte]
+            btd[bkey] = string.join(werte, glue.get(bkey, glue['default']))
         return btd
 
-    def toBibTeX(self):
+    def textdict(self, felder=None):
+        "wie BibTeXdict, aber ohne TeX-Codierung: {bkey: [unicode, ...]}"
+        if felder is None: felder = self.felder()
+        td = {}
+        for bkey, werte in felder.items():
+            td[bkey] = [self.text_uebersetzer(w) for w in werte]
+        return td
+
+    def toBibTeX(self, felder=None):
         erg = []
-        btd = self.BibTeXdict()
+        btd = self.BibTeXdict(felder)
         for key in btd.keys():
             erg.append("%s\t= {%s}" % (key, btd[key]))
         return "@book { %s,\n%s\n}\n\n" % (self['id'], string.join(erg, ",\n"))
 
 
+Datensatz.diagnose = Diagnose()
+# zulässige Feldcodes, zugleich zum Internieren der Schlüssel
+Datensatz.feldcodes = dict([(k, intern(k)) for k in Datensatz.mab2bib])
+# evtl. encoding='mac-roman'
+Datensatz.uebersetzer = Uebersetzer(Datensatz.tex_trans)
+Datensatz.text_uebersetzer = Uebersetzer(Datensatz.text_trans, ziel=None)
+
+
+class BibTeXWriter(object):
+    """Ausgabe als BibTeX; alle Writer bekommen den Datensatz und seine
+    Feldzuordnung (Datensatz.felder), die nur einmal berechnet wird"""
+
+    endung = '.bib'
+
+    def __init__(self, dateiname):
+        self.datei = open(dateiname, 'w')
+
+    def write(self, ds, felder):
+        self.datei.write(ds.toBibTeX(felder))
+
+    def close(self):
+        self.datei.close()
+
+
+class BibLaTeXWriter(BibTeXWriter):
+    """Ausgabe als BibLaTeX: andere Feldnamen, Listen mit 'and'"""
+
+    endung = '.biblatex.bib'
+
+    feldnamen = {
+        'address': 'location',
+        'annote': 'annotation',
+        'journal': 'journaltitle',
+        'year': 'date',
+        'ISBN': 'isbn',
+        'ISSN': 'issn',
+        'LCCN': 'lccn',
+    }
+
+    glue = dict(Datensatz.glue)
+    glue.update({
+        'address': ' and ',
+        'publisher': ' and ',
+    })
+
+    def write(self, ds, felder):
+        btd = ds.BibTeXdict(felder, self.glue)
+        erg = []
+        for key, val in btd.items():
+            erg.append("  %s = {%s}" % (self.feldnamen.get(key, key), val))
+        erg.sort()
+        self.datei.write("@book{%s,\n%s\n}\n\n" % (ds['id'], string.join(erg, ",\n")))
+
+
+class CSLJSONWriter(BibTeXWriter):
+    """Ausgabe als CSL-JSON (Liste von Objekten, UTF-8, ohne TeX-Codierung)"""
+
+    endung = '.json'
+
+    feldnamen = {
+        'title': 'title',
+        'series': 'collection-title',
+        'journal': 'container-title',
+        'institution': 'authority',
+        'edition': 'edition',
+        'address': 'publisher-place',
+        'publisher': 'publisher',
+        'pages': 'number-of-pages',
+        'volume': 'volume',
+        'note': 'note',
+        'annote': 'annote',
+        'type': 'genre',
+        'ISBN': 'ISBN',
+        'ISSN': 'ISSN',
+        'LCCN': 'call-number',
+        'howpublished': 'medium',
+        'copyright': 'rights',
+    }
+    namen = {'author': 'author', 'editor': 'editor'}
+    reJahr = re.compile('[0-9]{4}')
+
+    def __init__(self, dateiname):
+        BibTeXWriter.__init__(self, dateiname)
+        self.anzahl = 0
+        self.datei.write('[')
+
+    def name(self, name):
+        teile = [string.strip(t) for t in name.split(u',', 1)]
+        if len(teile) == 2 and teile[0] and teile[1]:
+            return {'family': teile[0], 'given': teile[1]}
+        return {'literal': name}
+
+    def eintrag(self, ds, felder):
+        erg = OrderedDict([('id', unicode(ds['id'], Datensatz.uebersetzer.encoding)), ('type', 'book')])
+        for bkey, werte in ds.textdict(felder).items():
+            if bkey in self.namen:
+                erg[self.namen[bkey]] = [self.name(w) for w in werte]
+            elif bkey == 'year':
+                jahr = self.reJahr.search(werte[0])
+                if jahr:
+                    erg['issued'] = {'date-parts': [[int(jahr.group())]]}
+                else:
+                    erg['issued'] = {'literal': werte[0]}
+            elif bkey in self.feldnamen:
+                erg[self.feldnamen[bkey]] = string.join(werte, ds.glue.get(bkey, ds.glue['default']))
+        return erg
+
+    def write(self, ds, felder):
+        if self.anzahl: self.datei.write(',')
+        self.anzahl += 1
+        self.datei.write('\n' + json.dumps(self.eintrag(ds, felder), ensure_ascii=False).encode('utf-8'))
+
+    def close(self):
+        self.datei.write('\n]\n')
+        BibTeXWriter.close(self)
+
+
+class RISWriter(BibTeXWriter):
+    """Ausgabe als RIS (UTF-8, ohne TeX-Codierung); Felder ohne RIS-Entsprechung
+    landen als 'Feld: Wert' in N1. Tags, die RIS nur einmal erlaubt, bekommen
+    alle Werte in einer Zeile, getrennt wie in BibTeX (Titel mit '. ')"""
+
+    endung = '.ris'
+
+    feldnamen = {
+        'author': 'AU',
+        'editor': 'ED',
+        'title': 'TI',
+        'series': 'T3',
+        'journal': 'T2',
+        'year': 'PY',
+        'publisher': 'PB',
+        'address': 'CY',
+        'edition': 'ET',
+        'volume': 'VL',
+        'pages': 'SP',
+        'ISBN': 'SN',
+        'ISSN': 'SN',
+        'LCCN': 'CN',
+        'note': 'N1',
+        'annote': 'AB',
+    }
+
+    # Tags, die mehrfach vorkommen dürfen
+    mehrfach = ('AU', 'ED', 'N1')
+
+    def write(self, ds, felder):
+        zeilen = [u'TY  - BOOK', u'ID  - ' + unicode(ds['id'], Datensatz.uebersetzer.encoding)]
+        einmal = {}
+        for bkey, werte in ds.textdict(felder).items():
+            tag = self.feldnamen.get(bkey)
+            if not tag:
+                for wert in werte:
+                    zeilen.append(u'N1  - %s: %s' % (bkey, wert))
+            elif tag in self.mehrfach:
+                for wert in werte:
+                    zeilen.append(u'%s  - %s' % (tag, wert))
+            else:
+                wert = string.join(werte, ds.glue.get(bkey, ds.glue['default']))
+                if tag in einmal:
+                    # ISBN und ISSN teilen sich SN
+                    zeilen[einmal[tag]] += ds.glue['default'] + wert
+                else:
+                    einmal[tag] = len(zeilen)
+                    zeilen.append(u'%s  - %s' % (tag, wert))
+        zeilen.append(u'ER  - ')
+        self.datei.write((string.join(zeilen, u'\n') + u'\n\n').encode('utf-8'))
+
+
+class SQLiteWriter(object):
+    """Katalog als SQLite-Datenbank: je Datensatz der BibTeX-Eintrag sowie Titel,
+    Personen, Reihe und Jahr als Text, mit Volltextindex (FTS5, sonst FTS4)
+    über Titel, Personen und Reihe; abfragen mit mabquery.py.
+    Die Datensätze werden in Transaktionen zu je batch Stück geladen,
+    der Volltextindex am Ende in einem Zug aufgebaut."""
+
+    endung = '.sqlite'
+    batch = 5000
+
+    schema = """
+        CREATE TABLE eintrag (id TEXT, title TEXT, author TEXT, series TEXT, year TEXT, bibtex TEXT);
+        CREATE INDEX eintrag_id ON eintrag (id);
+        CREATE INDEX eintrag_year ON eintrag (year);
+    """
+
+    def __init__(self, dateiname):
+        if os.path.exists(dateiname):
+            os.remove(dateiname)
+        self.db = sqlite3.connect(dateiname)
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.executescript(self.schema)
+        for fts in ('fts5', 'fts4'):
+            try:
+                self.db.execute("CREATE VIRTUAL TABLE suche USING %s(title, author, series, content='eintrag')" % fts)
+                break
+            except sqlite3.OperationalError:
+                pass
+        else:
+            raise sqlite3.OperationalError("SQLite hat weder FTS5 noch FTS4")
+        self.eintraege = []
+        self.encoding = Datensatz.uebersetzer.encoding
+
+    def write(self, ds, felder):
+        td = ds.textdict(felder)
+        def text(*bkeys):
+            werte = []
+            for bkey in bkeys:
+                werte.extend(td.get(bkey, []))
+            return werte and u' ; '.join(werte) or None
+        self.eintraege.append((unicode(ds['id'], self.encoding), text('title'), text('author', 'editor'),
+            text('series'), text('year'), unicode(ds.toBibTeX(felder), self.encoding)))
+        if len(self.eintraege) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("INSERT INTO eintrag VALUES (?,?,?,?,?,?)", self.eintraege)
+        self.db.commit()
+        self.eintraege = []
+
+    def close(self):
+        self.flush()
+        self.db.execute("INSERT INTO suche(suche) VALUES ('rebuild')")
+        self.db.commit()
+        self.db.close()
+
+
+# Ausgabeformate für --formats
+writers = OrderedDict([
+    ('bibtex', BibTeXWriter),
+    ('biblatex', BibLaTeXWriter),
+    ('csl', CSLJSONWriter),
+    ('ris', RISWriter),
+    ('sqlite', SQLiteWriter),
+])
+
 
 class MABfile(file):
     """?"""
@@ -165,38 +663,449 @@ class MABfile(file):
     reMABzeile = re.compile('^(?P<key>\d+\w?)\s+(?P<val>.+)$', re.IGNORECASE)
     reLeerzeile = re.compile('^\s*$')
 
-    def process(self):
-        """Lese MAB-Datei und erzeuge Liste von Datensätzen als self.daten"""
-        self.daten = []
-        dsno = -1
-        inds = False
-        for zeile in self.readlines():
+    def bloecke(self, start=0, ende=None):
+        """Liefert (Offset, Länge, Zeilen) für jeden Block nichtleerer Zeilen,
+        der zwischen den Byte-Offsets start und ende beginnt"""
+        self.seek(start)
+        pos = start
+        blockstart = pos
+        block = []
+        for zeile in self:
             if self.reLeerzeile.match(zeile):
-                if inds: inds = False
-                continue
+                if block:
+                    yield blockstart, pos - blockstart, block
+                    block = []
+            else:
+                if not block:
+                    if ende is not None and pos >= ende: return
+                    blockstart = pos
+                block.append(zeile)
+            pos += len(zeile)
+        if block:
+            yield blockstart, pos - blockstart, block
+
+    @classmethod
+    def datensatz(cls, zeilen, dsno):
+        """Erzeuge Datensatz Nr. dsno aus einem Block; None, wenn keine Zeile gültig ist"""
+        ds = None
+        diagnose = Datensatz.diagnose
+        diagnose.dsno = dsno
+        for zeile in zeilen:
             zeile = string.strip(zeile)
-            m = self.reMABzeile.match(zeile)
+            m = cls.reMABzeile.match(zeile)
             if not m:
-                print "Ungültige MAB-Zeile: %s" % zeile
+                diagnose.melde('ungültige Zeile', '-', zeile)
                 continue
             key = string.lower(m.group('key'))
             val = string.strip(m.group('val'))
-            if not inds:
+            if ds is None:
                 # neuer Datensatz
-                inds = True
-                dsno += 1
-                self.daten.append(Datensatz())
+                ds = Datensatz()
                 id = string.replace(string.lower(string.split(val, None, 2)[0]), ',', '')
-                self.daten[dsno]['id'] = id + str(dsno)
-            self.daten[dsno][key] = val
+                ds['id'] = id + str(dsno)
+            ds[key] = val
+        return ds
+
+    def datensaetze(self, start=0, ende=None, dsno=0):
+        """Erzeuge Datensätze aus dem Byte-Bereich start...ende, gezählt ab dsno"""
+        for offset, laenge, zeilen in self.bloecke(start, ende):
+            ds = self.datensatz(zeilen, dsno)
+            if ds is None: continue
+            dsno += 1
+            yield ds
+
+    def zaehle(self, start=0, ende=None):
+        """Anzahl der Datensätze im Byte-Bereich start...ende (ohne Konvertierung)"""
+        anzahl = 0
+        for offset, laenge, zeilen in self.bloecke(start, ende):
+            for zeile in zeilen:
+                if self.reMABzeile.match(string.strip(zeile)):
+                    anzahl += 1
+                    break
+        return anzahl
+
+    def teile(self, anzahl):
+        """Teile die Datei in bis zu anzahl Byte-Bereiche, die an Leerzeilen,
+        also an Datensatzgrenzen, enden. Liefert Liste von (start, ende)"""
+        self.seek(0, 2)
+        groesse = self.tell()
+        grenzen = [0]
+        for i in range(1, anzahl):
+            pos = max(groesse * i // anzahl, grenzen[-1])
+            self.seek(pos)
+            if pos > 0:
+                pos += len(self.readline()) # angeschnittene Zeile überspringen
+            while pos < groesse:
+                zeile = self.readline()
+                pos += len(zeile)
+                if self.reLeerzeile.match(zeile): break
+            if grenzen[-1] < pos < groesse:
+                grenzen.append(pos)
+        grenzen.append(groesse)
+        return zip(grenzen[:-1], grenzen[1:])
 
-    def writeBibTeXfile(self, dateiname):
+    def process(self):
+        """Lese MAB-Datei und erzeuge Liste von Datensätzen als self.daten"""
+        self.daten = list(self.datensaetze())
+
+    def writeBibTeXfile(self, dateiname, jobs=1):
+        if jobs > 1 and not hasattr(self, 'daten'):
+            return self.writeBibTeXfileParallel(dateiname, jobs)
         if not hasattr(self, 'daten'): self.process()
         btf = open(dateiname, 'w')
         for ds in self.daten:
             btf.write(ds.toBibTeX())
         btf.close()
 
+    def pruefsumme(self, offset, laenge=4096):
+        "MD5 der laenge Bytes vor offset, um ein Umschreiben der Datei zu erkennen"
+        start = max(0, offset - laenge)
+        self.seek(start)
+        return hashlib.md5(self.read(offset - start)).hexdigest()
+
+    def writeBibTeXfileIncremental(self, dateiname, checkpoint=None):
+        """Hängt nur die seit dem letzten Lauf angefügten Datensätze an die BibTeX-Datei an.
+
+        Der Checkpoint (Vorgabe <BibTeX-Datei>.ckpt) merkt sich Offset und Nummer
+        des letzten Blocks, die Länge der BibTeX-Datei davor und eine Prüfsumme
+        der Bytes vor dem Offset. Der letzte Block wird immer neu gelesen, weil
+        er inzwischen weitere Zeilen bekommen haben kann. Passt der Checkpoint
+        nicht mehr zur Datei, wird alles neu konvertiert.
+        Liefert die Nummer des ersten neu konvertierten Datensatzes.
+        """
+        checkpoint = checkpoint or dateiname + '.ckpt'
+        stand = None
+        if os.path.isfile(checkpoint) and os.path.isfile(dateiname):
+            stand = json.load(open(checkpoint))
+            self.seek(0, 2)
+            if (stand['mab'] != os.path.abspath(self.name)
+                or stand['offset'] > self.tell()
+                or stand['bib'] > os.path.getsize(dateiname)
+                or stand['pruefsumme'] != self.pruefsumme(stand['offset'])):
+                print "MAB-Datei wurde verändert, konvertiere vollständig"
+                stand = None
+        if stand:
+            btf = open(dateiname, 'r+b')
+            btf.truncate(stand['bib'])
+            btf.seek(0, 2)
+        else:
+            stand = {'mab': os.path.abspath(self.name), 'offset': 0, 'dsno': 0, 'bib': 0}
+            btf = open(dateiname, 'wb')
+        start = dsno = stand['dsno']
+        for offset, laenge, zeilen in self.bloecke(stand['offset']):
+            stand['offset'], stand['dsno'], stand['bib'] = offset, dsno, btf.tell()
+            ds = self.datensatz(zeilen, dsno)
+            if ds is None: continue
+            btf.write(ds.toBibTeX())
+            dsno += 1
+        btf.close()
+        stand['pruefsumme'] = self.pruefsumme(stand['offset'])
+        json.dump(stand, open(checkpoint, 'w'))
+        return start
+
+    def writeBibTeXfileParallel(self, dateiname, jobs):
+        """Konvertiere mit jobs Prozessen; Reihenfolge und IDs wie bei writeBibTeXfile.
+        Erst werden die Datensätze je Bereich gezählt, damit jeder Prozess
+        weiß, mit welcher Nummer er beginnt."""
+        import multiprocessing
+        bereiche = self.teile(jobs * 4)
+        pool = multiprocessing.Pool(jobs)
+        try:
+            anzahlen = pool.map(_zaehle, [(self.name, start, ende) for start, ende in bereiche])
+            auftraege = []
+            dsno = 0
+            for (start, ende), anzahl in zip(bereiche, anzahlen):
+                auftraege.append((self.name, start, ende, dsno))
+                dsno += anzahl
+            uebersetzer = Datensatz.uebersetzer
+            btf = open(dateiname, 'w')
+            for text, treffer, fehlschlaege, diagnose in pool.imap(_konvertiere, auftraege):
+                btf.write(text)
+                uebersetzer.treffer += treffer
+                uebersetzer.fehlschlaege += fehlschlaege
+                Datensatz.diagnose.update(diagnose)
+            btf.close()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _zaehle(args):
+    "Hilfsfunktion für den Prozess-Pool: Datensätze eines Bereichs zählen"
+    dateiname, start, ende = args
+    mabfile = MABfile(dateiname, 'rb')
+    anzahl = mabfile.zaehle(start, ende)
+    mabfile.close()
+    return anzahl
+
+def _konvertiere(args):
+    "Hilfsfunktion für den Prozess-Pool: Bereich ab Datensatz dsno nach BibTeX"
+    dateiname, start, ende, dsno = args
+    uebersetzer = Datensatz.uebersetzer
+    treffer, fehlschlaege = uebersetzer.treffer, uebersetzer.fehlschlaege
+    Datensatz.diagnose = Diagnose(Datensatz.diagnose.max_beispiele)
+    mabfile = MABfile(dateiname, 'rb')
+    erg = [ds.toBibTeX() for ds in mabfile.datensaetze(start, ende, dsno)]
+    mabfile.close()
+    return (string.join(erg, ''),
+        uebersetzer.treffer - treffer, uebersetzer.fehlschlaege - fehlschlaege,
+        Datensatz.diagnose)
+
+
+class MABindex(object):
+    """Index einer MAB-Datei als SQLite-Datenbank neben der Datei (<MAB-Datei>.idx)
+
+    Je Datensatz werden Byte-Offset, Länge, ID sowie ISBN (540), Titel (331)
+    und Jahr (425) gespeichert. Gefundene Datensätze werden per mmap direkt
+    aus der MAB-Datei gelesen, ohne sie zu durchsuchen.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, wert TEXT);
+        CREATE TABLE IF NOT EXISTS datensatz (
+            dsno INTEGER PRIMARY KEY, offset INTEGER, laenge INTEGER,
+            id TEXT, isbn TEXT, titel TEXT, jahr TEXT);
+        CREATE INDEX IF NOT EXISTS datensatz_id ON datensatz (id);
+        CREATE INDEX IF NOT EXISTS datensatz_isbn ON datensatz (isbn);
+        CREATE INDEX IF NOT EXISTS datensatz_jahr ON datensatz (jahr);
+    """
+
+    reISBN = re.compile('[^0-9X]')
+
+    def __init__(self, mabname, indexname=None):
+        self.mabname = mabname
+        self.indexname = indexname or mabname + '.idx'
+        self.db = sqlite3.connect(self.indexname)
+        self.db.text_factory = str
+        self.db.executescript(self.schema)
+
+    def close(self):
+        self.db.close()
+
+    def normalisiere_isbn(self, isbn):
+        return self.reISBN.sub('', string.upper(isbn))
+
+    def kennung(self):
+        "Größe und Änderungszeit der MAB-Datei, um einen veralteten Index zu erkennen"
+        st = os.stat(self.mabname)
+        return '%d:%d' % (st.st_size, int(st.st_mtime))
+
+    def aktuell(self):
+        zeile = self.db.execute("SELECT wert FROM meta WHERE name='kennung'").fetchone()
+        return zeile is not None and zeile[0] == self.kennung()
+
+    def erstelle(self):
+        "Index (neu) aufbauen"
+        kennung = self.kennung()
+        mabfile = MABfile(self.mabname, 'rb')
+        self.db.execute("DELETE FROM datensatz")
+        dsno = 0
+        eintraege = []
+        for offset, laenge, zeilen in mabfile.bloecke():
+            ds = mabfile.datensatz(zeilen, dsno)
+            if ds is None: continue
+            eintraege.append((dsno, offset, laenge, ds['id'],
+                self.normalisiere_isbn(ds.get('540', '')), ds.get('331'), ds.get('425')))
+            dsno += 1
+            if len(eintraege) >= 10000:
+                self.db.executemany("INSERT INTO datensatz VALUES (?,?,?,?,?,?,?)", eintraege)
+                eintraege = []
+        self.db.executemany("INSERT INTO datensatz VALUES (?,?,?,?,?,?,?)", eintraege)
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('kennung', ?)", (kennung,))
+        self.db.commit()
+        mabfile.close()
+        return dsno
+
+    def suche(self, id=None, isbn=None, titel=None, jahr=None):
+        "Liefert (dsno, offset, laenge) der passenden Datensätze"
+        bedingungen = []
+        werte = []
+        if id is not None:
+            bedingungen.append('id = ?')
+            werte.append(id)
+        if isbn is not None:
+            bedingungen.append('isbn = ?')
+            werte.append(self.normalisiere_isbn(isbn))
+        if titel is not None:
+            bedingungen.append('titel LIKE ?')
+            werte.append('%' + titel + '%')
+        if jahr is not None:
+            bedingungen.append('jahr = ?')
+            werte.append(jahr)
+        sql = "SELECT dsno, offset, laenge FROM datensatz"
+        if bedingungen:
+            sql += " WHERE " + string.join(bedingungen, ' AND ')
+        return self.db.execute(sql + " ORDER BY dsno", werte).fetchall()
+
+    def datensaetze(self, treffer):
+        "Liest die Datensätze zu Suchergebnissen per mmap aus der MAB-Datei"
+        if not treffer: return
+        mabfile = open(self.mabname, 'rb')
+        daten = mmap.mmap(mabfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for dsno, offset, laenge in treffer:
+                zeilen = daten[offset:offset+laenge].splitlines(True)
+                yield MABfile.datensatz(zeilen, dsno)
+        finally:
+            daten.close()
+            mabfile.close()
+
+
+class Dubletten(object):
+    """Erkennt Dubletten im Datensatz-Strom, z.B. beim Zusammenführen von Exporten
+    mehrerer Bibliotheken: über die normalisierte ISBN/ISSN und über einen
+    Schlüssel aus Titel, erstem Autor und Jahr.
+
+    Der Index hält höchstens grenze Schlüssel (MD5-Digests) im Speicher und
+    lagert darüber hinaus in eine temporäre SQLite-Datenbank aus.
+    """
+
+    isbnfelder = ('540', '540a', '540b')
+    issnfelder = ('542',)
+    titelfelder = ('331',)
+    autorfelder = ('100', '104', '108', '112', '100e', '100f')
+    jahrfelder = ('425',)
+
+    # Ziffern, höchstens durch einzelne Bindestriche getrennt, damit eine
+    # folgende Zahl (z.B. der Preis) nicht zur ISBN gerechnet wird
+    reISBN = re.compile('(?<![0-9])[0-9](?:-?[0-9]){8,11}-?[0-9X](?![0-9X])', re.IGNORECASE)
+    reISSN = re.compile('[0-9]{4}-?[0-9]{3}[0-9X]', re.IGNORECASE)
+    reWort = re.compile('\W+', re.UNICODE)
+    reJahr = re.compile('[0-9]{4}')
+
+    def __init__(self, grenze=1000000, encoding='latin-1'):
+        self.grenze = grenze
+        self.encoding = encoding
+        self.index = {}
+        self.db = None
+        self.dateiname = None
+        self.gefunden = 0
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.dateiname)
+            self.db = None
+
+    def gueltig(self, isbn):
+        "Prüfziffer einer ISBN-10 oder ISBN-13 (ohne Bindestriche) stimmt"
+        if len(isbn) == 10:
+            ziffern = [z == 'X' and 10 or int(z) for z in isbn]
+            return 'X' not in isbn[:9] and sum([(10 - i) * z for i, z in enumerate(ziffern)]) % 11 == 0
+        if len(isbn) == 13 and isbn.isdigit():
+            return sum([int(z) * (i % 2 and 3 or 1) for i, z in enumerate(isbn)]) % 10 == 0
+        return False
+
+    def isbn13(self, isbn):
+        "ISBN-10 in ISBN-13 umrechnen, damit beide Schreibweisen gleich sind"
+        if len(isbn) != 10: return isbn
+        isbn = '978' + isbn[:9]
+        summe = sum([int(z) * (i % 2 and 3 or 1) for i, z in enumerate(isbn)])
+        return isbn + str((10 - summe % 10) % 10)
+
+    def normalisiere(self, s):
+        "Kleinbuchstaben ohne Akzente, Satzzeichen und Mehrfach-Leerzeichen"
+        s = unicodedata.normalize('NFKD', unicode(s, self.encoding, 'replace').lower())
+        s = u''.join([c for c in s if not unicodedata.combining(c)])
+        return string.strip(self.reWort.sub(u' ', s)).encode('utf-8')
+
+    def erster(self, ds, felder):
+        for feld in felder:
+            if feld in ds: return ds[feld]
+        return ''
+
+    def schluessel(self, ds):
+        "Liste der Vergleichsschlüssel eines Datensatzes"
+        erg = []
+        for feld in self.isbnfelder:
+            for isbn in self.reISBN.findall(ds.get(feld, '')):
+                isbn = string.upper(isbn.replace('-', ''))
+                if self.gueltig(isbn):
+                    erg.append(('isbn', self.isbn13(isbn)))
+        for feld in self.issnfelder:
+            for issn in self.reISSN.findall(ds.get(feld, '')):
+                erg.append(('issn', string.upper(issn.replace('-', ''))))
+        titel = self.normalisiere(self.erster(ds, self.titelfelder))
+        autor = self.normalisiere(string.split(self.erster(ds, self.autorfelder), ',')[0])
+        jahr = self.reJahr.findall(self.erster(ds, self.jahrfelder))
+        # ein Titel allein ('Gedichte', 'Briefe') ist kein Merkmal einer Dublette
+        if titel and (autor or jahr):
+            erg.append(('titel', '%s|%s|%s' % (titel, autor, jahr and jahr[0] or '')))
+        return [(art, hashlib.md5(art + ':' + k).digest()) for art, k in erg]
+
+    def auslagern(self):
+        "Index in die SQLite-Datenbank schreiben und den Speicher leeren"
+        if self.db is None:
+            fd, self.dateiname = tempfile.mkstemp(suffix='.sqlite', prefix='mab2bib-')
+            os.close(fd)
+            self.db = sqlite3.connect(self.dateiname)
+            self.db.text_factory = str
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute("CREATE TABLE schluessel (k BLOB PRIMARY KEY, id TEXT)")
+        self.db.executemany("INSERT OR IGNORE INTO schluessel VALUES (?, ?)",
+            [(sqlite3.Binary(k), v) for k, v in self.index.iteritems()])
+        self.db.commit()
+        self.index.clear()
+
+    def suche(self, k):
+        if k in self.index: return self.index[k]
+        if self.db is not None:
+            zeile = self.db.execute("SELECT id FROM schluessel WHERE k = ?", (sqlite3.Binary(k),)).fetchone()
+            if zeile: return zeile[0]
+        return None
+
+    def pruefe(self, ds):
+        """(ID des früheren gleichen Datensatzes, Art des Schlüssels) oder None;
+        merkt sich die Schlüssel"""
+        schluessel = self.schluessel(ds)
+        for art, k in schluessel:
+            original = self.suche(k)
+            if original is not None:
+                return original, art
+        for art, k in schluessel:
+            self.index[k] = ds['id']
+        if len(self.index) > self.grenze:
+            self.auslagern()
+        return None
+
+    def filter(self, datensaetze):
+        "Liefert die Datensätze ohne Dubletten; die erste Fundstelle bleibt erhalten"
+        for ds in datensaetze:
+            gefunden = self.pruefe(ds)
+            if gefunden is None:
+                yield ds
+            else:
+                self.gefunden += 1
+                original, art = gefunden
+                Datensatz.diagnose.melde('Dublette', art, "%s entspricht %s" % (ds['id'], original))
+
+
+def konvertiere(mabnamen, ausgaben, dubletten=None):
+    """Konvertiert MAB-Dateien und gibt jeden Datensatz an alle Writer in ausgaben;
+    die Datensätze werden über alle Dateien fortlaufend nummeriert"""
+    def alle():
+        dsno = 0
+        for mabname in mabnamen:
+            mabfile = MABfile(mabname, 'rb')
+            for ds in mabfile.datensaetze(dsno=dsno):
+                yield ds
+                dsno += 1
+            mabfile.close()
+    datensaetze = alle()
+    if dubletten is not None:
+        datensaetze = dubletten.filter(datensaetze)
+    for ds in datensaetze:
+        felder = ds.felder()
+        for writer in ausgaben:
+            writer.write(ds, felder)
+    for writer in ausgaben:
+        writer.close()
+
+def writeBibTeXfiles(mabnamen, dateiname, dubletten=None):
+    "Konvertiert mehrere MAB-Dateien in eine BibTeX-Datei"
+    konvertiere(mabnamen, [BibTeXWriter(dateiname)], dubletten)
+
 
 def help():
     print AppInfo
@@ -204,15 +1113,126 @@ def help():
     sys.exit(0)
 
 if __name__=='__main__':
-    if len(sys.argv) < 2: help()
-    mabname = sys.argv[1]
-    if not os.path.isfile(mabname):
-        print "MAB-Datei '%s' nicht gefunden!" % mabfile
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "j:c:sil:ao:df:r:q",
+            ["jobs=", "cache=", "stats", "index", "lookup=", "incremental",
+             "output=", "dedup", "dedup-limit=", "formats=", "report=", "quiet"])
+    except getopt.GetoptError, ex:
+        print ex
+        help()
+    if len(args) < 1: help()
+    jobs = 1
+    stats = False
+    index = False
+    suche = None
+    inkrementell = False
+    bibname = None
+    dubletten = None
+    formate = ['bibtex']
+    bericht = None
+    leise = False
+    for (o, a) in opts:
+        if o in ('-j', '--jobs'):
+            jobs = int(a)
+        elif o in ('-c', '--cache'):
+            Datensatz.uebersetzer.groesse = max(1, int(a))
+        elif o in ('-s', '--stats'):
+            stats = True
+        elif o in ('-i', '--index'):
+            index = True
+        elif o in ('-l', '--lookup'):
+            suche = a
+        elif o in ('-a', '--incremental'):
+            inkrementell = True
+        elif o in ('-o', '--output'):
+            bibname = a
+        elif o in ('-d', '--dedup'):
+            dubletten = dubletten or Dubletten()
+        elif o == '--dedup-limit':
+            dubletten = dubletten or Dubletten()
+            dubletten.grenze = int(a)
+        elif o in ('-r', '--report'):
+            bericht = a
+        elif o in ('-q', '--quiet'):
+            leise = True
+        elif o in ('-f', '--formats'):
+            formate = [string.strip(f) for f in a.split(',')]
+            for f in formate:
+                if f not in writers:
+                    print "Unbekanntes Format '%s' (%s)" % (f, string.join(writers.keys(), ', '))
+                    sys.exit(1)
+    if bibname:
+        mabnamen = args
+    else:
+        mabnamen = args[:1]
+        bibname = mabnamen[0]+'.bib'
+        if len(args) > 1:
+            bibname = args[1]
+    for mabname in mabnamen:
+        if not os.path.isfile(mabname):
+            print "MAB-Datei '%s' nicht gefunden!" % mabname
+            sys.exit(1)
+    mabname = mabnamen[0]
+    # --jobs und --incremental gibt es nur für die Konvertierung einer Datei nach BibTeX
+    zusammen = dubletten is not None or len(mabnamen) > 1 or formate != ['bibtex']
+    for gesetzt, option in ((jobs > 1, '--jobs'), (inkrementell, '--incremental')):
+        if gesetzt and zusammen:
+            print "%s geht nur mit einer MAB-Datei nach BibTeX, nicht mit --formats, --dedup oder mehreren Dateien" % option
+            sys.exit(1)
+    if jobs > 1 and inkrementell:
+        print "--jobs und --incremental gehen nicht zusammen"
         sys.exit(1)
-    bibname = mabname+'.bib'
-    if len(sys.argv) > 2:
-        bibname = sys.argv[2]
 
-    mabfile = MABfile(mabname, 'r')
-    mabfile.writeBibTeXfile(bibname)
-    mabfile.close()
+    if index or suche is not None:
+        mabindex = MABindex(mabname)
+        if index or not mabindex.aktuell():
+            print "Index %s: %d Datensätze" % (mabindex.indexname, mabindex.erstelle())
+        if suche is not None:
+            if ':' in suche:
+                feld, wert = suche.split(':', 1)
+            else:
+                feld, wert = 'id', suche
+            if feld not in ('id', 'isbn', 'titel', 'jahr'):
+                print "Unbekanntes Suchfeld '%s' (id, isbn, titel, jahr)" % feld
+                sys.exit(1)
+            # der Index enthält die Latin-1-Bytes der MAB-Datei
+            kodierung = sys.stdin.encoding or locale.getpreferredencoding() or 'utf-8'
+            try:
+                wert = unicode(wert, kodierung).encode('latin-1')
+            except UnicodeError:
+                print "Suchwert '%s' ist nicht %s oder nicht in Latin-1 darstellbar" % (wert, kodierung)
+                sys.exit(1)
+            for ds in mabindex.datensaetze(mabindex.suche(**{feld: wert})):
+                sys.stdout.write(ds.toBibTeX())
+        mabindex.close()
+
+    elif dubletten is not None or len(mabnamen) > 1 or formate != ['bibtex']:
+        basis = bibname
+        if basis.endswith('.bib'): basis = basis[:-4]
+        ausgaben = []
+        for f in formate:
+            if f == 'bibtex':
+                ausgaben.append(BibTeXWriter(bibname))
+            else:
+                ausgaben.append(writers[f](basis + writers[f].endung))
+        konvertiere(mabnamen, ausgaben, dubletten)
+        if dubletten is not None:
+            print "%d Dubletten entfernt" % dubletten.gefunden
+            dubletten.close()
+
+    else:
+        mabfile = MABfile(mabname, 'rb')
+        if inkrementell:
+            start = mabfile.writeBibTeXfileIncremental(bibname)
+            if start:
+                print "Fortgesetzt ab Datensatz %d" % start
+        else:
+            mabfile.writeBibTeXfile(bibname, jobs)
+        mabfile.close()
+
+    if stats:
+        print Datensatz.uebersetzer.statistik()
+    if bericht:
+        Datensatz.diagnose.bericht(bericht)
+    if not leise:
+        print >>sys.stderr, Datensatz.diagnose.zusammenfassung()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks für mab2bib mit synthetischen MAB-Exporten
+
+Aufruf:
+  [python] mabbench.py generate [Optionen] <MAB-Datei>
+      schreibt eine synthetische MAB-Datei (Latin-1)
+  [python] mabbench.py run [Optionen] [<MAB-Datei>]
+      misst Einlesen, Übersetzen und die ganze Konvertierung, dazu den
+      bisher größten Speicherbedarf (RSS) nach jeder Messung und den
+      Speicher je Datensatz (Datensatz mit __slots__ gegen ein dict);
+      ohne MAB-Datei wird eine temporäre erzeugt
+  [python] mabbench.py check [Optionen]
+      prüft mit einer temporären MAB-Datei, dass mab2bib.py --lookup
+      Titel mit Umlauten (als UTF-8 übergeben) im Index findet und dass
+      die RIS-Ausgabe nur AU, ED und N1 mehrfach je Datensatz enthält;
+      außerdem die Schlüssel von --dedup für einige ISBN-Schreibweisen
+
+Optionen:
+--records=N     Anzahl der Datensätze beim Erzeugen (10000)
+--seed=N        Startwert des Zufallsgenerators (1)
+--fields=Feld:Anteil,...
+                Anteil der Datensätze mit dem jeweiligen MAB-Feld,
+                z.B. 331:1,100:0.9,540:0.5 (sonst eine typische Verteilung)
+--dirty=Anteil  Anteil der Datensätze mit unbekannten Feldern oder
+                ungültigen Zeilen (0.05)
+--repeat=N      jede Messung N-mal, gewertet wird die schnellste (3)
+--output=<JSON-Datei>
+                Ergebnisse als JSON speichern (sonst nur Ausgabe)
+
+Die Datei mab2bib.py und latex.py müssen im gleichen Verzeichnis liegen!
+"""
+
+import os, sys, time, random, getopt, tempfile, platform, json, subprocess, hashlib, resource
+verzeichnis = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, verzeichnis)
+from mab2bib import Datensatz, Diagnose, MABfile, MABindex, RISWriter, Dubletten, konvertiere
+
+# typischer Anteil der Datensätze, die ein Feld haben
+verteilung = {
+    '100': 0.9, '100b': 0.05, '104': 0.3, '104a': 0.1, '108': 0.1, '112': 0.03,
+    '200': 0.05, '304': 0.05, '310': 0.05, '331': 1.0, '335': 0.4, '359': 0.7,
+    '400': 0.3, '403': 0.2, '410': 0.9, '412': 0.9, '425': 0.95, '433': 0.8,
+    '451': 0.3, '455': 0.3, '501': 0.2, '519': 0.05, '540': 0.6, '540a': 0.1,
+    '542': 0.05, '590': 0.05,
+}
+
+nachnamen = ['M\xfcller', 'Schr\xf6der', 'Gro\xdfmann', 'Wei\xdf', 'Bauer', 'Jochum',
+    'K\xf6hler', 'Hoffmann', 'Sch\xe4fer', 'Fran\xe7ois', 'Ramm', 'L\xf6we']
+vornamen = ['Hans', 'J\xfcrgen', 'Uwe', 'Ren\xe9', 'Anna', 'B\xe4rbel', 'Henning']
+woerter = ['Geschichte', '\xdcber', 'die', 'der', 'und', 'Sprache', 'B\xfccher',
+    'Bibliothek', 'Stra\xdfe', 'M\xe4rchen', 'Theorie', 'Praxis', '\xd6konomie',
+    'im', 'Wandel', 'Zeit', 'Welt', 'Ged\xe4chtnis', 'Fr\xfche', 'Neuzeit']
+orte = ['Berlin', 'M\xfcnchen', 'K\xf6ln', 'Konstanz', 'Z\xfcrich', 'Wien', 'Frankfurt a.M.']
+verlage = ['Springer', 'Suhrkamp', 'Beck', 'de Gruyter', 'Vandenhoeck & Ruprecht',
+    'B\xf6hlau', 'Klett-Cotta', 'Fink']
+reihen = ['Studien zur Geschichte', 'Beitr\xe4ge zur Sprachwissenschaft',
+    'Schriften der Universit\xe4t Konstanz', 'Edition Suhrkamp']
+
+def person(zufall):
+    return '%s, %s' % (zufall.choice(nachnamen), zufall.choice(vornamen))
+
+def titel(zufall):
+    woerter_ = [zufall.choice(woerter) for i in range(zufall.randint(2, 8))]
+    t = ' '.join(woerter_)
+    r = zufall.random()
+    if r < 0.15:
+        t += ' ...'                     # Auslassung -> \dots
+    elif r < 0.3:
+        t += ' - ' + zufall.choice(woerter)     # Gedankenstrich -> --
+    elif r < 0.4:
+        t = '&lt;Die&gt; ' + t          # Nicht-Sortierwort
+    elif r < 0.45:
+        t = '\xacDer\xac ' + t
+    return t
+
+def isbn(zufall):
+    ziffern = [3] + [zufall.randint(0, 9) for i in range(8)]
+    pruef = sum([(10 - i) * z for i, z in enumerate(ziffern)]) % 11
+    pruef = (11 - pruef) % 11
+    return '3-%s-%s-%s' % (''.join(map(str, ziffern[1:4])), ''.join(map(str, ziffern[4:9])),
+        pruef == 10 and 'X' or str(pruef))
+
+werte = {
+    '1': person, '2': person,
+    '3': titel,
+    '359': person,
+    '400': lambda z: '%d. Aufl.' % z.randint(1, 12),
+    '403': lambda z: '%d., \xfcberarb. Aufl.' % z.randint(2, 9),
+    '410': lambda z: z.choice(orte),
+    '412': lambda z: z.choice(verlage),
+    '425': lambda z: str(z.randint(1700, 2010)),
+    '433': lambda z: '%d S.' % z.randint(20, 1200),
+    '451': lambda z: z.choice(reihen),
+    '455': lambda z: str(z.randint(1, 300)),
+    '540': isbn,
+    '542': lambda z: '%04d-%04d' % (z.randint(0, 9999), z.randint(0, 9999)),
+}
+
+def wert(feld, zufall):
+    "Feldwert passend zum MAB-Feld"
+    for praefix in (feld[:3], feld[:1]):
+        if praefix in werte:
+            return werte[praefix](zufall)
+    return titel(zufall)
+
+def generate(dateiname, anzahl=10000, seed=1, felder=None, schmutz=0.05):
+    """Schreibt eine synthetische MAB-Datei mit anzahl Datensätzen"""
+    zufall = random.Random(seed)
+    felder = sorted((felder or verteilung).items())
+    for feld, anteil in felder:
+        if feld not in Datensatz.mab2bib:
+            raise ValueError("Feld '%s' ist nicht in Datensatz.mab2bib" % feld)
+    datei = open(dateiname, 'wb')
+    for dsno in range(anzahl):
+        zeilen = []
+        for feld, anteil in felder:
+            if zufall.random() < anteil:
+                zeilen.append('%-4s %s' % (feld, wert(feld, zufall)))
+        if zufall.random() < schmutz:
+            if zufall.random() < 0.5:
+                zeilen.append('999 %s' % titel(zufall))
+            else:
+                zeilen.insert(zufall.randint(0, len(zeilen)), '-- unvollst\xe4ndige Zeile')
+        datei.write('\n'.join(zeilen) + '\n\n')
+    datei.close()
+
+def messe(funktion, wiederholungen):
+    "schnellste von wiederholungen Laufzeiten in Sekunden"
+    zeiten = []
+    for i in range(wiederholungen):
+        start = time.time()
+        funktion()
+        zeiten.append(time.time() - start)
+    return min(zeiten)
+
+def rss():
+    "größter Speicherbedarf (RSS) des Prozesses bisher in KB"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024                 # dort in Bytes
+    return maxrss
+
+def speicher(daten):
+    """Mittlerer Speicher je Datensatz in Bytes ohne die Werte, die in
+    beiden Formen dieselben Strings sind: der Datensatz mit seinen zwei
+    Listen und ein dict mit denselben Feldern, wie früher je Datensatz"""
+    slots = sum([sys.getsizeof(ds) + sys.getsizeof(ds.schluessel) + sys.getsizeof(ds.werte)
+        for ds in daten])
+    dicts = sum([sys.getsizeof(dict(zip(ds.schluessel, ds.werte))) for ds in daten])
+    anzahl = max(len(daten), 1)
+    return slots / float(anzahl), dicts / float(anzahl)
+
+def run(mabname, wiederholungen=3):
+    """Misst Einlesen, Übersetzen (mit und ohne Cache) und Konvertierung"""
+    Datensatz.diagnose = Diagnose()
+    mabfile = MABfile(mabname, 'rb')
+    mabfile.process()
+    daten = mabfile.daten
+    mabfile.close()
+    feldwerte = [wert for ds in daten for wert in ds.values()]
+    je_slots, je_dict = speicher(daten)
+    print "%-20s %8d mit %7.1f Bytes je Datensatz, als dict %7.1f" % ('memory', len(daten), je_slots, je_dict)
+    uebersetzer = Datensatz.uebersetzer
+    bibname = tempfile.mktemp(suffix='.bib')
+
+    def einlesen():
+        mabfile = MABfile(mabname, 'rb')
+        for ds in mabfile.datensaetze(): pass
+        mabfile.close()
+
+    def uebersetzen():
+        uebersetzer.cache.clear()
+        for wert in feldwerte: uebersetzer(wert)
+
+    def uebersetzen_ohne_cache():
+        for wert in feldwerte: uebersetzer.uebersetze(wert)
+
+    def uebersetzen_gemeinsam():
+        uebersetzer.cache.clear()
+        uebersetzer.alle(feldwerte)
+
+    def konvertieren():
+        mabfile = MABfile(mabname, 'rb')
+        mabfile.writeBibTeXfile(bibname)
+        mabfile.close()
+
+    ergebnisse = []
+    for name, funktion, anzahl in (
+            ('parse', einlesen, len(daten)),
+            ('translate', uebersetzen, len(feldwerte)),
+            ('translate-uncached', uebersetzen_ohne_cache, len(feldwerte)),
+            ('translate-batch', uebersetzen_gemeinsam, len(feldwerte)),
+            ('convert', konvertieren, len(daten))):
+        sekunden = messe(funktion, wiederholungen)
+        # ru_maxrss wächst nur, also der Höchststand bis zum Ende dieser Messung
+        ergebnisse.append({
+            'benchmark': name,
+            'items': anzahl,
+            'seconds': round(sekunden, 4),
+            'items_per_second': round(anzahl / max(sekunden, 1e-9), 1),
+            'max_rss_kb': rss(),
+        })
+        print "%-20s %8d in %7.3f s = %10.0f/s, RSS %7d KB" % (
+            name, anzahl, sekunden, anzahl / max(sekunden, 1e-9), rss())
+    os.remove(bibname)
+    return {
+        'file': os.path.abspath(mabname),
+        'bytes': os.path.getsize(mabname),
+        'records': len(daten),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cache_hit_rate': round(uebersetzer.trefferquote(), 1),
+        'bytes_per_record': round(je_slots, 1),
+        'bytes_per_record_dict': round(je_dict, 1),
+        'results': ergebnisse,
+    }
+
+def check_suche(mabname):
+    """Sucht Titelwörter mit Umlauten über mab2bib.py --lookup (UTF-8 auf
+    der Kommandozeile) und vergleicht mit der Suche im Index (Latin-1);
+    liefert die Zahl der Abweichungen"""
+    mabindex = MABindex(mabname)
+    mabindex.erstelle()
+    abweichungen = 0
+    for wort in (u'Stra\xdfe', u'\xdcber', u'Ged\xe4chtnis', u'B\xfccher'):
+        erwartet = len(mabindex.suche(titel=wort.encode('latin-1')))
+        ausgabe = subprocess.Popen([sys.executable, os.path.join(verzeichnis, 'mab2bib.py'),
+            '--quiet', '--lookup=titel:' + wort.encode('utf-8'), mabname],
+            stdout=subprocess.PIPE, env=dict(os.environ, LC_ALL='C.UTF-8')).communicate()[0]
+        erhalten = len([zeile for zeile in ausgabe.splitlines() if zeile.startswith('@')])
+        if not erwartet or erhalten != erwartet:
+            print "--lookup=titel:%s: erwartet %d, erhalten %d" % (wort.encode('utf-8'), erwartet, erhalten)
+            abweichungen += 1
+    mabindex.close()
+    os.remove(mabindex.indexname)
+    return abweichungen
+
+def check_ris(mabname):
+    """Schreibt RIS und zählt Datensätze mit mehrfachen Tags, die RIS nur
+    einmal erlaubt"""
+    risname = tempfile.mktemp(suffix='.ris')
+    konvertiere([mabname], [RISWriter(risname)])
+    abweichungen = 0
+    for eintrag in open(risname).read().split('\nER  - \n'):
+        tags = [zeile[:2] for zeile in eintrag.splitlines() if zeile[2:6] == '  - ']
+        doppelt = sorted(set([tag for tag in tags if tag not in RISWriter.mehrfach and tags.count(tag) > 1]))
+        if doppelt:
+            print "RIS: %s mehrfach in\n%s" % (', '.join(doppelt), eintrag)
+            abweichungen += 1
+    os.remove(risname)
+    return abweichungen
+
+# Felder eines Datensatzes und die erwarteten Schlüssel (vor dem MD5) von Dubletten
+dubletten = [
+    ({'540': '3-540-12345-8 20 EUR'}, [('isbn', '9783540123453')]),
+    ({'540': '3-540-12345-8 (kart.) : DM 20.00'}, [('isbn', '9783540123453')]),
+    ({'540': '3540123458'}, [('isbn', '9783540123453')]),
+    ({'540': '978-3-540-12345-3'}, [('isbn', '9783540123453')]),
+    ({'540': '3-540-12345-9 20'}, []),
+    ({'540': '3-8233-4000-x'}, [('isbn', '9783823340003')]),
+    ({'540': '3-540-12345-8', '540a': '0-387-12345-8'}, [('isbn', '9783540123453'), ('isbn', '9780387123455')]),
+    ({'540': '3-540-12345-8', '540a': '3-540-12345-0'}, [('isbn', '9783540123453')]),
+    ({'331': 'Gedichte'}, []),
+    ({'331': 'Gedichte', '425': '1998'}, [('titel', 'gedichte||1998')]),
+    ({'331': 'Gedichte', '100': 'Heine, Heinrich'}, [('titel', 'gedichte|heine|')]),
+]
+
+def check_dubletten():
+    """Vergleicht Dubletten.schluessel mit den erwarteten Schlüsseln"""
+    d = Dubletten()
+    abweichungen = 0
+    for felder, erwartet in dubletten:
+        erhalten = d.schluessel(Datensatz(felder, id='x'))
+        if erhalten != [(art, hashlib.md5(art + ':' + k).digest()) for art, k in erwartet]:
+            print "Dubletten %r: erwartet %r, erhalten %r" % (felder, erwartet, [art for art, k in erhalten])
+            abweichungen += 1
+    return abweichungen
+
+def check(anzahl=2000, seed=1):
+    """Prüft mit einer temporären MAB-Datei, liefert die Zahl der Abweichungen"""
+    mabname = tempfile.mktemp(suffix='.mab')
+    generate(mabname, anzahl, seed)
+    try:
+        abweichungen = check_suche(mabname)
+        abweichungen += check_ris(mabname)
+        abweichungen += check_dubletten()
+    finally:
+        os.remove(mabname)
+    print "%d Datensätze, %d Abweichungen" % (anzahl, abweichungen)
+    return abweichungen
+
+def help(message=""):
+    print message
+    print __doc__
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "n:s:f:d:r:o:",
+            ["records=", "seed=", "fields=", "dirty=", "repeat=", "output="])
+    except getopt.GetoptError, ex:
+        help(ex)
+    if not args or args[0] not in ('generate', 'run', 'check'):
+        help()
+    anzahl, seed, felder, schmutz, wiederholungen, ausgabe = 10000, 1, None, 0.05, 3, None
+    for (o, a) in opts:
+        if o in ('-n', '--records'):
+            anzahl = int(a)
+        elif o in ('-s', '--seed'):
+            seed = int(a)
+        elif o in ('-f', '--fields'):
+            felder = dict([(f.split(':')[0], float(f.split(':')[1])) for f in a.split(',')])
+        elif o in ('-d', '--dirty'):
+            schmutz = float(a)
+        elif o in ('-r', '--repeat'):
+            wiederholungen = int(a)
+        elif o in ('-o', '--output'):
+            ausgabe = a
+
+    if args[0] == 'generate':
+        if len(args) < 2: help(u"MAB-Datei fehlt!")
+        try:
+            generate(args[1], anzahl, seed, felder, schmutz)
+        except ValueError, ex:
+            help(ex)
+        print "%s: %d Datensätze, %d Bytes" % (args[1], anzahl, os.path.getsize(args[1]))
+    elif args[0] == 'check':
+        sys.exit(check(anzahl, seed) and 1 or 0)
+    else:
+        if len(args) > 1:
+            mabname = args[1]
+            temporaer = False
+        else:
+            mabname = tempfile.mktemp(suffix='.mab')
+            generate(mabname, anzahl, seed, felder, schmutz)
+            temporaer = True
+        ergebnis = run(mabname, wiederholungen)
+        if temporaer:
+            os.remove(mabname)
+        if ausgabe:
+            json.dump(ergebnis, open(ausgabe, 'w'), indent=2)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Suche im SQLite-Katalog von mab2bib (mab2bib.py --formats=sqlite ...)
+
+Aufruf: [python] mabquery.py [Optionen] <Katalog> <Suchbegriffe>
+
+Gibt die BibTeX-Einträge der gefundenen Datensätze aus.
+Suchbegriffe in der Syntax der SQLite-Volltextsuche, z.B.
+  Goethe Faust        beide Wörter
+  "Faust II"          Phrase
+  Schill*             Präfix
+  Praxis OR Theorie   eines der Wörter
+
+Optionen:
+--field=title|author|series
+                nur in diesem Feld suchen (sonst Titel, Personen und Reihe)
+--year=Jahr     nur Datensätze dieses Jahres
+--limit=N       höchstens N Treffer (100)
+"""
+
+import os, sys, time, getopt, sqlite3
+
+felder = ('title', 'author', 'series')
+
+def suche(katalog, begriffe, feld=None, jahr=None, limit=100, encoding='latin-1'):
+    """Liefert die BibTeX-Einträge der Treffer in der Reihenfolge des Exports"""
+    # mit einer Spalte links von MATCH gilt die ganze Suche (mit Phrasen
+    # und OR/NOT) nur für diese Spalte, mit FTS5 wie mit FTS4
+    if feld and feld not in felder:
+        raise ValueError("Unbekanntes Feld '%s'" % feld)
+    sql = ("SELECT eintrag.bibtex FROM suche JOIN eintrag ON eintrag.rowid = suche.rowid "
+        "WHERE suche.%s MATCH ?" % (feld or 'suche'))
+    werte = [begriffe]
+    if jahr:
+        sql += " AND eintrag.year = ?"
+        werte.append(jahr)
+    sql += " ORDER BY eintrag.rowid LIMIT ?"
+    werte.append(limit)
+    db = sqlite3.connect(katalog)
+    try:
+        return [bibtex.encode(encoding) for (bibtex,) in db.execute(sql, werte)]
+    finally:
+        db.close()
+
+def help(message=""):
+    print message
+    print __doc__
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "f:y:l:", ["field=", "year=", "limit="])
+    except getopt.GetoptError, ex:
+        help(ex)
+    if len(args) < 2:
+        help("Zu wenige Parameter angegeben!")
+    feld, jahr, limit = None, None, 100
+    for (o, a) in opts:
+        if o in ('-f', '--field'):
+            if a not in felder:
+                help("Unbekanntes Feld '%s'" % a)
+            feld = a
+        elif o in ('-y', '--year'):
+            jahr = a
+        elif o in ('-l', '--limit'):
+            limit = int(a)
+    katalog = args[0]
+    if not os.path.isfile(katalog):
+        help("Katalog '%s' nicht gefunden!" % katalog)
+    begriffe = unicode(' '.join(args[1:]), sys.stdin.encoding or 'utf-8')
+
+    start = time.time()
+    try:
+        treffer = suche(katalog, begriffe, feld, jahr, limit)
+    except sqlite3.OperationalError, ex:
+        help("Ungültige Suche: %s" % ex)
+    dauer = time.time() - start
+    for bibtex in treffer:
+        sys.stdout.write(bibtex)
+    sys.stderr.write("%d Treffer in %.1f ms\n" % (len(treffer), dauer * 1000))
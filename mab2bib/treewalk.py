@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Gemeinsamer Verzeichnisdurchlauf für die Datei-Werkzeuge
+
+    from treewalk import Baumlauf
+    for verzeichnis, eintraege in Baumlauf(pfad, einschliessen='*.txt'):
+        for eintrag in eintraege:
+            print(eintrag.path, eintrag.stat().st_size)
+
+Jedes Verzeichnis wird einmal mit os.scandir gelesen (unter Python 2
+mit dem Paket scandir, ohne beides mit os.listdir). Die Einträge sind
+DirEntry-Objekte oder verhalten sich so: is_dir(), is_file() und stat()
+brauchen meist keinen weiteren Systemaufruf, stat() wird gemerkt.
+Geliefert werden Stapel aus je einem Verzeichnis, in der Reihenfolge
+von os.walk (von oben nach unten); mit threads werden die Verzeichnisse
+einer Ebene parallel gelesen (für Netzlaufwerke), die Reihenfolge ist
+dann beliebig. Umbenennen sollte man erst nach dem Durchlauf.
+
+Aufruf als Benchmark:
+  [python] treewalk.py [Optionen] [<Verzeichnis>]
+      vergleicht os.walk mit Baumlauf, jeweils mit und ohne stat;
+      ohne Verzeichnis wird ein temporärer Baum erzeugt
+
+Optionen:
+--entries=N     Einträge im erzeugten Baum (1000000), je 100 pro Verzeichnis
+--threads=N     Threads für den parallelen Durchlauf (4)
+--repeat=N      jede Messung N-mal, gewertet wird die schnellste (3)
+"""
+
+from __future__ import print_function
+import os, re, sys, stat, time, getopt, fnmatch, shutil, tempfile
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+class Eintrag(object):
+    "Ersatz für DirEntry, wenn es kein scandir gibt; stat() wird gemerkt"
+    __slots__ = ('name', 'path', '_stat', '_lstat')
+
+    def __init__(self, verzeichnis, name):
+        self.name = name
+        self.path = os.path.join(verzeichnis, name)
+        self._stat = self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+            return self._lstat
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat(False).st_mode)
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def __repr__(self):
+        return '<Eintrag %r>' % self.name
+
+def lies(verzeichnis):
+    "Liste der Einträge eines Verzeichnisses"
+    if scandir:
+        return list(scandir(verzeichnis))
+    return [Eintrag(verzeichnis, name) for name in os.listdir(verzeichnis)]
+
+def muster(namen):
+    """Ein regulärer Ausdruck für ein Shell-Muster (fnmatch, mit Groß-
+    und Kleinschreibung) oder eine Liste davon; None für keine"""
+    if not namen:
+        return None
+    if not isinstance(namen, (list, tuple, set)):
+        namen = [namen]
+    return re.compile('|'.join(['(?:%s)' % fnmatch.translate(name) for name in namen]))
+
+class Baumlauf(object):
+    """Durchlauf durch den Baum unter wurzel; liefert Paare (Verzeichnis,
+    Liste von höchstens stapel Einträgen), leere Stapel nicht.
+
+    einschliessen   Muster für die Dateien, die geliefert werden (sonst alle)
+    ausschliessen   Muster für Namen (auch von Verzeichnissen), die übergangen werden
+    versteckte      auch Namen, die mit '.' beginnen
+    verzeichnisse   auch Unterverzeichnisse liefern (im Stapel ihres
+                    Elternverzeichnisses, also vor ihrem Inhalt)
+    rekursiv        in Unterverzeichnisse absteigen
+    links           symbolischen Links auf Verzeichnisse folgen (sonst
+                    gelten sie wie bei os.walk als Verzeichnisse, in die
+                    nicht abgestiegen wird)
+    threads         Verzeichnisse mit so vielen Threads lesen
+    bei_fehler      bekommt den OSError, wenn ein Verzeichnis nicht
+                    lesbar ist (sonst wird er ausgelöst)
+
+    ignoriert zählt danach die übergangenen versteckten Einträge."""
+
+    def __init__(self, wurzel, einschliessen=None, ausschliessen=None, versteckte=False,
+            verzeichnisse=False, rekursiv=True, links=False, stapel=1000, threads=0, bei_fehler=None):
+        self.wurzel = wurzel
+        self.einschliessen = muster(einschliessen)
+        self.ausschliessen = muster(ausschliessen)
+        self.versteckte = versteckte
+        self.verzeichnisse = verzeichnisse
+        self.rekursiv = rekursiv
+        self.links = links
+        self.stapel = stapel
+        self.threads = threads
+        self.bei_fehler = bei_fehler
+        self.ignoriert = 0
+
+    def _lies(self, verzeichnis):
+        """Liest ein Verzeichnis; liefert (Verzeichnis, Treffer,
+        Unterverzeichnisse, ignorierte versteckte)"""
+        treffer, unter, ignoriert = [], [], 0
+        try:
+            inhalt = lies(verzeichnis)
+        except OSError as ex:
+            if self.bei_fehler is None:
+                raise
+            self.bei_fehler(ex)
+            return verzeichnis, treffer, unter, ignoriert
+        for eintrag in inhalt:
+            name = eintrag.name
+            if not self.versteckte and name.startswith('.'):
+                ignoriert += 1
+            elif self.ausschliessen and self.ausschliessen.match(name):
+                pass
+            elif eintrag.is_dir():
+                if self.rekursiv and (self.links or not eintrag.is_symlink()):
+                    unter.append(eintrag.path)
+                if self.verzeichnisse:
+                    treffer.append(eintrag)
+            elif not self.einschliessen or self.einschliessen.match(name):
+                treffer.append(eintrag)
+        return verzeichnis, treffer, unter, ignoriert
+
+    def _stapel(self, verzeichnis, treffer):
+        for i in range(0, len(treffer), self.stapel):
+            yield verzeichnis, treffer[i:i + self.stapel]
+
+    def __iter__(self):
+        if self.threads > 1:
+            return self._parallel()
+        return self._seriell()
+
+    def _seriell(self):
+        offen = [self.wurzel]
+        while offen:
+            verzeichnis, treffer, unter, ignoriert = self._lies(offen.pop())
+            self.ignoriert += ignoriert
+            unter.reverse()
+            offen.extend(unter)
+            for paar in self._stapel(verzeichnis, treffer):
+                yield paar
+
+    def _parallel(self):
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.threads)
+        try:
+            ebene = [self.wurzel]
+            while ebene:
+                naechste = []
+                for verzeichnis, treffer, unter, ignoriert in pool.imap_unordered(self._lies, ebene):
+                    self.ignoriert += ignoriert
+                    naechste.extend(unter)
+                    for paar in self._stapel(verzeichnis, treffer):
+                        yield paar
+                ebene = naechste
+        finally:
+            pool.terminate()
+            pool.join()
+
+def erzeuge(wurzel, anzahl, breite=100):
+    "Baum mit anzahl leeren Dateien, breite je Verzeichnis, zwei Ebenen tief"
+    for nummer in range(max(1, anzahl // breite)):
+        verzeichnis = os.path.join(wurzel, 'd%03d' % (nummer // breite), 'd%05d' % nummer)
+        os.makedirs(verzeichnis)
+        for datei in range(breite):
+            open(os.path.join(verzeichnis, 'f%03d.txt' % datei), 'w').close()
+
+def messe(funktion, wiederholungen):
+    "schnellste von wiederholungen Laufzeiten in Sekunden und das Ergebnis"
+    zeiten = []
+    for i in range(wiederholungen):
+        start = time.time()
+        ergebnis = funktion()
+        zeiten.append(time.time() - start)
+    return min(zeiten), ergebnis
+
+def run(wurzel, threads=4, wiederholungen=3):
+    """Zählt die Dateien (und summiert ihre Größen) mit os.walk und Baumlauf"""
+    def walk():
+        return sum([len(dateien) for pfad, verzeichnisse, dateien in os.walk(wurzel)])
+
+    def walk_stat():
+        return sum([os.path.getsize(os.path.join(pfad, datei)) >= 0
+            for pfad, verzeichnisse, dateien in os.walk(wurzel) for datei in dateien])
+
+    def baumlauf(threads=0):
+        return sum([len(eintraege) for pfad, eintraege in Baumlauf(wurzel, versteckte=True, threads=threads)])
+
+    def baumlauf_stat(threads=0):
+        return sum([eintrag.stat().st_size >= 0
+            for pfad, eintraege in Baumlauf(wurzel, versteckte=True, threads=threads) for eintrag in eintraege])
+
+    for name, funktion in (
+            ('os.walk', walk),
+            ('os.walk+stat', walk_stat),
+            ('Baumlauf', baumlauf),
+            ('Baumlauf+stat', baumlauf_stat),
+            ('Baumlauf/%d' % threads, lambda: baumlauf(threads)),
+            ('Baumlauf/%d+stat' % threads, lambda: baumlauf_stat(threads))):
+        sekunden, anzahl = messe(funktion, wiederholungen)
+        print("%-20s %8d in %7.3f s = %10.0f/s" % (name, anzahl, sekunden, anzahl / max(sekunden, 1e-9)))
+
+def help(message=""):
+    print(message)
+    print(__doc__)
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "e:t:r:", ["entries=", "threads=", "repeat="])
+    except getopt.GetoptError as ex:
+        help(ex)
+    anzahl, threads, wiederholungen = 1000000, 4, 3
+    for (o, a) in opts:
+        if o in ('-e', '--entries'):
+            anzahl = int(a)
+        elif o in ('-t', '--threads'):
+            threads = int(a)
+        elif o in ('-r', '--repeat'):
+            wiederholungen = int(a)
+    if args:
+        if not os.path.isdir(args[0]):
+            help("%s ist kein Verzeichnis!" % args[0])
+        run(args[0], threads, wiederholungen)
+    else:
+        wurzel = tempfile.mkdtemp(prefix='treewalk.')
+        try:
+            start = time.time()
+            erzeuge(wurzel, anzahl)
+            print("%s: %d Dateien erzeugt in %.1f s" % (wurzel, anzahl, time.time() - start))
+            run(wurzel, threads, wiederholungen)
+        finally:
+            shutil.rmtree(wurzel)